@@ -0,0 +1,959 @@
+# Simulated instruments: a VISA resource manager and a Leonardo library which replace real devices
+# at the lowest level (see visa_device.UseResourceManager and Leonardo.UseLibrary),
+# so all driver code is executed as with real devices, without NI-VISA, GPIB or Windows.
+#
+# Each simulated device is a state machine which parses SCPI (or LakeShore) commands.
+# Devices share one world state: an excitation current through a sample, a temperature, a magnetic field etc.,
+# so e.g. a voltmeter measures a voltage produced by a current source.
+#
+# Usage: EnableSimulation() before creating drivers, or "-sim" command line argument of measurement scripts.
+import re
+import time
+import threading
+import numpy as np
+
+from Drivers import visa_device
+from Drivers import Leonardo
+
+LEONARDO_SIGNAL_CHANNEL = 6  # Leonardo channel where a sample voltage is measured (as in EquipmentBase)
+
+
+# Converts a SCPI header pattern into a regular expression.
+# Long form keywords match both short and long forms: "SOURce" matches "SOUR" and "SOURCE",
+# [...] is an optional part, # is a numeric suffix (captured), e.g. "OUTPut#[:STATe]?"
+def _scpi_regex(pattern):
+    parts = []
+    for token in re.findall(r'[A-Za-z]+|.', pattern):
+        if token == '[':
+            parts.append('(?:')
+        elif token == ']':
+            parts.append(')?')
+        elif token == '#':
+            parts.append(r'(\d*)')
+        elif token[0].isalpha():
+            short = token.rstrip('abcdefghijklmnopqrstuvwxyz')
+            rest = token[len(short):]
+            parts.append(f'{short}(?:{rest.upper()})?' if rest else short)
+        else:
+            parts.append(re.escape(token))
+    return re.compile(':?' + ''.join(parts) + '$', re.IGNORECASE)
+
+
+# Parses a number with optional units, e.g. "1GHz", "-30dBm", "0.1S"
+def _number(text):
+    return float(re.match(r'\s*[-+]?[\d.]+(?:[eE][-+]?\d+)?', text).group())
+
+
+def _on_off(text):
+    return text.strip().upper() in ('1', 'ON')
+
+
+def _format_values(values):
+    return ','.join(f'{v:.9e}' for v in np.atleast_1d(values))
+
+
+# A sample: a resistor. See SampleModel for superconducting samples.
+class OhmicSample:
+    def __init__(self, resistance=100.):
+        self.resistance = resistance
+
+    # current in amperes (a scalar or an array), t - time.time() values
+    def Voltage(self, current, t, world):
+        return np.asarray(current, dtype=float) * self.resistance
+
+
+# A shared state of a simulated setup
+class SimWorld:
+    def __init__(self, time_scale=1.):
+        self.lock = threading.RLock()
+        self.rng = np.random.default_rng()
+
+        # 1 - devices take as much time as real ones (measurements, ADC blocks, temperature changes),
+        # 0 - everything is instant
+        self.time_scale = time_scale
+
+        self.instruments = {}  # address -> simulated device
+        self.roles = {}  # role (e.g. "excitation") -> address
+
+        self.sample = OhmicSample()
+        self.bias_resistance = 1e+4  # a resistor which converts a voltage source output into a current, ohms
+        self.gain = 1.  # an amplifier gain before Leonardo
+        self.adc_noise = 1e-5  # volts rms at Leonardo inputs
+        self.voltmeter_noise = 1e-8  # volts rms of a voltmeter reading
+        self.adc_inputs = {LEONARDO_SIGNAL_CHANNEL: self.AmplifiedSampleVoltage}  # channel -> function of time
+
+        # cryostat
+        self.base_temperature = 0.02  # K
+        self.temperature = self.base_temperature
+        self.setpoint = self.base_temperature
+        self.heater_on = False
+        self.thermal_tau = 3.  # seconds
+        self._temperature_time = time.time()
+
+        # magnet, microwave generator, AWG
+        self.field = 0.  # gauss, of a magnet power supply (AMI430)
+        self.field_coil_constant = 100.  # G/A, of a coil driven by a current source (see FieldUtils)
+        self.rf_on = False
+        self.rf_frequency = 1e+9  # Hz
+        self.rf_power = -100.  # dBm
+        self.awg = {'output': False, 'frequency': 1., 'high': 0., 'low': 0.}
+
+    # Waits for a simulated operation time
+    def Wait(self, seconds):
+        if seconds > 0 and self.time_scale > 0:
+            time.sleep(seconds * self.time_scale)
+
+    # time.time() when an operation which ends at t_end of a simulated time is completed
+    def ReadyTime(self, t_end):
+        now = time.time()
+        return now + max(t_end - now, 0) * self.time_scale
+
+    def AddInstrument(self, address, instrument):
+        with self.lock:
+            self.instruments[address] = instrument
+            if isinstance(instrument, SimSource):
+                self.roles.setdefault('excitation', address)  # the first source drives a sample by default
+
+    def SetRole(self, role, address):
+        with self.lock:
+            self.roles[role] = address
+
+    # A device which has a role. If a gate or field source is not set explicitly, it is a Yokogawa
+    # (not an excitation source) in a voltage or a current mode respectively.
+    def RoleInstrument(self, role):
+        device = self.instruments.get(self.roles.get(role))
+        if device is None and role in ('gate', 'field'):
+            excitation = self.roles.get('excitation')
+            device = next((d for a, d in self.instruments.items() if a != excitation
+                           and isinstance(d, SimYokogawaGS200) and d.current_mode == (role == 'field')), None)
+        return device
+
+    # Current through a sample, amperes, at times t
+    def ExcitationCurrent(self, t):
+        source = self.RoleInstrument('excitation')
+        if source is None:
+            return np.zeros(np.shape(t))
+        return source.Current(t)
+
+    # Magnetic field at a sample, gauss, at times t
+    def Field(self, t):
+        source = self.RoleInstrument('field')
+        if source is None:
+            return np.full(np.shape(t), self.field)
+        return self.field + source.Current(t) * self.field_coil_constant
+
+    # Gate voltage, volts, at times t
+    def GateVoltage(self, t):
+        source = self.RoleInstrument('gate')
+        if source is None or not source.output:
+            return np.zeros(np.shape(t))
+        return source.Level(t)
+
+    def SampleVoltage(self, t):
+        return self.sample.Voltage(self.ExcitationCurrent(t), t, self)
+
+    def AmplifiedSampleVoltage(self, t):
+        return self.gain * self.SampleVoltage(t)
+
+    def VoltmeterReading(self, t):
+        return self.SampleVoltage(t) + self.voltmeter_noise * self.rng.standard_normal(np.shape(t))
+
+    # Leonardo data: (samples, channels) array for times t
+    def AdcVoltages(self, channels, t):
+        data = self.adc_noise * self.rng.standard_normal((len(t), len(channels)))
+        for i, ch in enumerate(channels):
+            source = self.adc_inputs.get(ch)
+            if source is not None:
+                data[:, i] += source(t)
+        return data
+
+    # Devices armed for external triggers (e.g. a voltmeter waiting for Trigger Link or BNC triggers)
+    def TriggerListeners(self):
+        return [d for d in self.instruments.values() if getattr(d, 'armed', False)]
+
+    # Sends triggers at times t to all armed devices
+    def Trigger(self, times):
+        for device in self.TriggerListeners():
+            device.ExternalTrigger(times)
+
+    # Cryostat: a temperature relaxes exponentially to a setpoint (if a heater is on) or to a base temperature
+    def Temperature(self):
+        with self.lock:
+            now = time.time()
+            target = self.setpoint if self.heater_on else self.base_temperature
+            tau = self.thermal_tau * self.time_scale
+            if tau <= 0:
+                self.temperature = target
+            else:
+                self.temperature = target + (self.temperature - target) * np.exp(-(now - self._temperature_time) / tau)
+            self._temperature_time = now
+            return self.temperature
+
+    def SetTemperatureControl(self, setpoint=None, heater_on=None):
+        with self.lock:
+            self.Temperature()  # update a temperature with old settings
+            if setpoint is not None:
+                self.setpoint = setpoint
+            if heater_on is not None:
+                self.heater_on = heater_on
+
+
+# A simulated device: a message-based state machine.
+# commands - a list of (SCPI header pattern, method name), a method gets an argument string and numeric suffixes.
+# A query method returns a response string. Commands without a handler are stored as settings,
+# and a query of such setting returns a stored value.
+class SimInstrument:
+    commands = [('*IDN?', '_idn'), ('*OPC?', '_opc'), ('*RST', '_reset'), ('*CLS', '_cls'),
+                ('SYSTem:ERRor[:NEXT]?', '_error')]
+    model_name = 'SIMULATED'
+
+    def __init__(self, world, address):
+        self.world = world
+        self.address = address
+        self.settings = {}
+        self.errors = []
+        self._responses = []
+        self._reported_headers = set()
+
+    @classmethod
+    def _handlers(cls):
+        if '_compiled' not in cls.__dict__:
+            cls._compiled = [(_scpi_regex(p), name) for p, name in cls.commands]
+        return cls._compiled
+
+    # Executes a message (commands separated by ";")
+    def Write(self, message):
+        with self.world.lock:
+            for cmd in message.split(';'):
+                cmd = cmd.strip()
+                if cmd:
+                    self._execute(cmd)
+
+    def _execute(self, cmd):
+        header, _, args = cmd.partition(' ')
+        for regex, name in self._handlers():
+            m = regex.match(header)
+            if m:
+                resp = getattr(self, name)(args.strip(), *m.groups())
+                if header.endswith('?'):
+                    self._responses.append(str(resp))
+                return
+        key = header.lstrip(':').upper()
+        if key.endswith('?'):
+            value = self.settings.get(key[:-1])
+            if value is None:
+                self._unknown(header)
+                value = '0'
+            self._responses.append(value)
+        else:
+            self.settings[key] = args.strip()
+
+    def _unknown(self, header):
+        self.errors.append(f'-113,"Undefined header {header}"')
+        if header not in self._reported_headers:
+            self._reported_headers.add(header)
+            print(f'Simulator: {type(self).__name__} does not know {header}')
+
+    # Returns responses of executed queries, raises a timeout error if there is nothing to read
+    def Read(self):
+        with self.world.lock:
+            if not self._responses:
+                raise visa_device.VisaIOError(visa_device.VI_ERROR_TMO)
+            resp = ';'.join(self._responses)
+            self._responses = []
+            return resp + '\n'
+
+    def Clear(self):
+        with self.world.lock:
+            self._responses = []
+
+    def _idn(self, args):
+        return f'SIMULATED,{self.model_name},0,0'
+
+    def _opc(self, args):
+        return '1'
+
+    def _reset(self, args):
+        self.settings = {}
+
+    def _cls(self, args):
+        self.errors = []
+
+    def _error(self, args):
+        return self.errors.pop(0) if self.errors else '0,"No error"'
+
+
+# A device with an output: a level, an output state and an optional schedule of levels (a hardware sweep)
+class SimSource(SimInstrument):
+    def __init__(self, world, address):
+        super().__init__(world, address)
+        self.level = 0.
+        self.output = False
+        self.current_mode = True  # False - a voltage output, converted into a current by a bias resistor
+        self._schedule = None  # (times, levels) of a hardware sweep
+
+    def SetLevel(self, value):
+        self.level = value
+        self._schedule = None
+
+    # Levels at times t (vectorised), a schedule gives levels after its times
+    def Level(self, t):
+        t = np.asarray(t, dtype=float)
+        if self._schedule is None:
+            return np.full(t.shape, self.level)
+        times, levels = self._schedule
+        idx = np.searchsorted(times, t, side='right') - 1
+        return np.where(idx >= 0, levels[np.clip(idx, 0, None)], self.level)
+
+    def Current(self, t):
+        if not self.output:
+            return np.zeros(np.shape(t))
+        level = self.Level(t)
+        return level if self.current_mode else level / self.world.bias_resistance
+
+
+class SimYokogawaGS200(SimSource):
+    model_name = 'GS210'
+    commands = SimInstrument.commands + [
+        ('[SOURce:]FUNCtion', '_function'), ('[SOURce:]FUNCtion?', '_function_q'),
+        ('[SOURce:]LEVel[:AUTO]', '_level'), ('[SOURce:]LEVel[:AUTO]?', '_level_q'),
+        ('OUTPut[:STATe]', '_output'), ('OUTPut[:STATe]?', '_output_q'),
+        ('PROGram:EDIT:STARt', '_edit_start'), ('PROGram:EDIT:END', '_edit_end'),
+        ('PROGram:INTerval', '_interval'), ('PROGram:RUN', '_run'),
+    ]
+
+    def __init__(self, world, address):
+        super().__init__(world, address)
+        self.current_mode = False
+        self._program = None  # levels being edited
+        self._steps = []
+        self._program_interval = 1.
+
+    def _function(self, args):
+        self.current_mode = args.upper().startswith('CURR')
+
+    def _function_q(self, args):
+        return 'CURR' if self.current_mode else 'VOLT'
+
+    def _level(self, args):
+        if self._program is not None:
+            self._program.append(_number(args))
+        else:
+            self.SetLevel(_number(args))
+
+    def _level_q(self, args):
+        return f'{float(self.Level(time.time())):.6e}'
+
+    def _output(self, args):
+        self.output = _on_off(args)
+
+    def _output_q(self, args):
+        return '1' if self.output else '0'
+
+    def _edit_start(self, args):
+        self._program = []
+
+    def _edit_end(self, args):
+        self._steps, self._program = self._program, None
+
+    def _interval(self, args):
+        self._program_interval = _number(args)
+
+    # Steps are made by a device timer, a BNC output sends a trigger at each step
+    def _run(self, args):
+        if not self._steps:
+            return
+        levels = np.array(self._steps)
+        times = time.time() + self._program_interval * np.arange(len(levels))
+        self._schedule = (times, levels)
+        self.level = levels[-1]  # a level after a program end
+        self.world.Trigger(times)
+
+
+class SimKeithley6200(SimSource):
+    model_name = 'MODEL 6221'
+    commands = SimInstrument.commands + [
+        ('CLEar', '_clear'), ('OUTPut[:STATe]', '_output'), ('OUTPut[:STATe]?', '_output_q'),
+        ('[SOURce:]CURRent[:LEVel][:IMMediate][:AMPLitude]', '_current'),
+        ('[SOURce:]CURRent[:LEVel][:IMMediate][:AMPLitude]?', '_current_q'),
+        ('[SOURce:]LIST:CURRent', '_list_current'), ('[SOURce:]LIST:CURRent:APPend', '_list_current_append'),
+        ('[SOURce:]LIST:DELay', '_list_delay'), ('[SOURce:]LIST:DELay:APPend', '_list_delay_append'),
+        ('[SOURce:]SWEep:ARM', '_sweep_arm'), ('[SOURce:]SWEep:ABORt', '_abort'),
+        ('[SOURce:]DELTa:ARM', '_delta_arm'), ('[SOURce:]DCONductance:ARM', '_dcon_arm'),
+        ('[SOURce:]PDELta:ARM', '_pdelta_arm'), ('[SOURce:]DELTa:NVPResent?', '_nv_present'),
+        ('INITiate[:IMMediate]', '_init'), ('UNIT[:VOLTage][:DC]', '_unit'),
+        ('TRACe:CLEar', '_trace_clear'), ('TRACe:POINts:ACTual?', '_trace_actual'), ('TRACe:DATA?', '_trace_data'),
+    ]
+
+    def __init__(self, world, address):
+        super().__init__(world, address)
+        self._list_values = []
+        self._delays = []
+        self._armed = None  # an armed mode: "sweep", "delta", "dcon", "pdelta"
+        self._unit_name = 'VOLT'
+        self._trace = np.empty(0)
+        self._trace_ready = np.empty(0)  # time.time() when each trace reading is available
+
+    def _clear(self, args):
+        self.output = False
+        self.SetLevel(0.)
+        self._armed = None
+
+    def _output(self, args):
+        self.output = _on_off(args)
+
+    def _output_q(self, args):
+        return '1' if self.output else '0'
+
+    def _current(self, args):
+        self.SetLevel(_number(args))
+
+    def _current_q(self, args):
+        return f'{self.level:.6e}'
+
+    def _list_current(self, args):
+        self._list_values = [float(v) for v in args.split(',')]
+
+    def _list_current_append(self, args):
+        self._list_values += [float(v) for v in args.split(',')]
+
+    def _list_delay(self, args):
+        self._delays = [float(v) for v in args.split(',')]
+
+    def _list_delay_append(self, args):
+        self._delays += [float(v) for v in args.split(',')]
+
+    def _sweep_arm(self, args):
+        self._armed = 'sweep'
+
+    def _delta_arm(self, args):
+        self._armed = 'delta'
+
+    def _dcon_arm(self, args):
+        self._armed = 'dcon'
+
+    def _pdelta_arm(self, args):
+        self._armed = 'pdelta'
+
+    def _abort(self, args):
+        self._armed = None
+        self._schedule = None
+
+    def _nv_present(self, args):
+        return '1' if any(isinstance(d, SimKeithley2182A) for d in self.world.instruments.values()) else '0'
+
+    def _unit(self, args):
+        self._unit_name = args.upper()[:4]
+
+    def _trace_clear(self, args):
+        self._trace = np.empty(0)
+        self._trace_ready = np.empty(0)
+
+    def _trace_actual(self, args):
+        return str(int(np.sum(self._trace_ready <= time.time())))
+
+    def _trace_data(self, args):
+        return _format_values(self._trace[self._trace_ready <= time.time()])
+
+    # A value of a stored setting, e.g. SOURce:DELTa:HIGH
+    def _setting(self, mode, name, default=0.):
+        regex = _scpi_regex(f'[SOURce:]{mode}:{name}')
+        for key, value in self.settings.items():
+            if regex.match(key):
+                return _number(value)
+        return default
+
+    def _init(self, args):
+        armed, self._armed = self._armed, None
+        if armed == 'sweep':
+            self._list_sweep()
+        elif armed in ('delta', 'dcon', 'pdelta'):
+            self._delta_mode(armed)
+
+    # A list sweep stepped over Trigger Link: a voltmeter is triggered after a delay of each step,
+    # the next step begins when its reading is complete
+    def _list_sweep(self):
+        levels = np.array(self._list_values)
+        delays = np.resize(np.array(self._delays or [1e-3]), len(levels))
+        listeners = self.world.TriggerListeners()
+        reading_time = max([d.ReadingTime() for d in listeners], default=0.)
+        step_times = np.cumsum(np.hstack(([0], (delays + reading_time)[:-1])))
+        times = time.time() + step_times
+        end = times[-1] + delays[-1] + reading_time
+        # a device returns to a fixed level after a sweep
+        self._schedule = (np.hstack((times, [end])), np.hstack((levels, [self.level])))
+        self.world.Trigger(times + delays)
+
+    # Delta modes: a device controls a 2182A itself and stores results in its buffer
+    def _delta_mode(self, mode):
+        world = self.world
+        now = time.time()
+        noise = world.voltmeter_noise
+        if mode == 'delta':
+            delay = self._setting('DELTa', 'DELay', 2e-3)
+            current = self._setting('DELTa', 'HIGH', 1e-6)
+            n = int(self._setting('DELTa', 'COUNt', 1))
+            v = world.sample.Voltage(np.array([current, -current]), now, world)
+            values = (v[0] - v[1]) / 2 + noise * world.rng.standard_normal(n)
+            values = values / current if self._unit_name == 'OHMS' else values
+            point_time = 3 * (delay + 0.02)
+        elif mode == 'dcon':
+            delay = self._setting('DCONductance', 'DELay', 2e-3)
+            start, step = self._setting('DCONductance', 'STARt'), self._setting('DCONductance', 'STEP', 1.)
+            stop, delta = self._setting('DCONductance', 'STOP'), self._setting('DCONductance', 'DELTa')
+            currents = start + step * np.arange(int(round((stop - start) / step)) + 1)
+            dv = world.sample.Voltage(currents + delta, now, world) - world.sample.Voltage(currents - delta, now, world)
+            dv = dv + noise * world.rng.standard_normal(len(currents))
+            values = dv / (2 * delta) if self._unit_name == 'OHMS' else dv
+            point_time = 2 * (delay + 0.02)
+        else:  # pulse delta with a list sweep
+            currents = np.array(self._list_values)
+            values = world.sample.Voltage(currents, now, world) + noise * world.rng.standard_normal(len(currents))
+            point_time = self._setting('PDELta', 'INTerval', 5) / 50
+        ready = now + point_time * np.arange(1, len(values) + 1)
+        self._trace = np.asarray(values, dtype=float)
+        self._trace_ready = np.array([world.ReadyTime(t) for t in ready])
+
+
+# A voltmeter which may take readings on external triggers into its buffer
+class SimVoltmeter(SimInstrument):
+    def __init__(self, world, address):
+        super().__init__(world, address)
+        self.nplc = 5.
+        self.armed = False
+        self._trigger_delay = 0.
+        self._buffer_count = 1
+        self._buffer = []  # (ready time, value)
+
+    def ReadingTime(self):
+        return self.nplc / 50 + 0.01
+
+    def _nplc(self, args):
+        self.nplc = _number(args)
+
+    def _reading(self):
+        self.world.Wait(self.ReadingTime())
+        return float(self.world.VoltmeterReading(time.time()))
+
+    def ExternalTrigger(self, times):
+        n = self._buffer_count - len(self._buffer)
+        times = np.asarray(times)[:max(n, 0)] + self._trigger_delay
+        if len(times) == 0:
+            return
+        values = self.world.VoltmeterReading(times)
+        self._buffer += [(self.world.ReadyTime(t + self.ReadingTime()), v) for t, v in zip(times, values)]
+        if len(self._buffer) >= self._buffer_count:
+            self.armed = False
+
+    def _buffer_actual(self, args):
+        now = time.time()
+        return str(sum(1 for t, _ in self._buffer if t <= now))
+
+    def _buffer_data(self, args):
+        now = time.time()
+        return _format_values([v for t, v in self._buffer if t <= now])
+
+
+class SimKeithley2182A(SimVoltmeter):
+    model_name = 'MODEL 2182A'
+    commands = SimInstrument.commands + [
+        ('[SENSe:]VOLTage[:DC]:NPLCycles', '_nplc'), ('[SENSe:]CHANnel', '_channel'),
+        ('READ?', '_read'), ('FETCh?', '_read'),
+        ('TRACe:CLEar', '_trace_clear'), ('TRACe:POINts', '_trace_points'),
+        ('TRACe:POINts:ACTual?', '_buffer_actual'), ('TRACe:DATA?', '_buffer_data'),
+        ('TRIGger:SOURce', '_trigger_source'), ('TRIGger:DELay', '_trigger_delay_set'),
+        ('TRIGger:COUNt', '_trigger_count'), ('INITiate[:IMMediate]', '_init'),
+    ]
+
+    def __init__(self, world, address):
+        super().__init__(world, address)
+        self._channel_num = 1
+        self._external = False
+
+    def _channel(self, args):
+        self._channel_num = int(_number(args))
+
+    def _read(self, args):
+        value = self._reading()
+        if self._channel_num != 1:  # only a sample voltage is connected to channel 1
+            value -= float(self.world.SampleVoltage(time.time()))
+        return f'{value:.9e}'
+
+    def _trace_clear(self, args):
+        self._buffer = []
+
+    def _trace_points(self, args):
+        self._buffer_count = int(_number(args))
+
+    def _trigger_source(self, args):
+        self._external = args.upper().startswith('EXT')
+
+    def _trigger_delay_set(self, args):
+        self._trigger_delay = _number(args)
+
+    def _trigger_count(self, args):
+        self._buffer_count = int(_number(args))
+
+    def _init(self, args):
+        self.armed = self._external
+
+
+class SimKeithley2400(SimSource):
+    model_name = 'MODEL 2400'
+    commands = SimInstrument.commands + [
+        ('[SOURce:]FUNCtion[:MODE]', '_function'), ('OUTPut[:STATe]', '_output'),
+        ('[SOURce:]CURRent:MODE', '_mode'), ('[SOURce:]VOLTage:MODE', '_mode'),
+        ('[SOURce:]CURRent[:LEVel][:IMMediate][:AMPLitude]', '_level'),
+        ('[SOURce:]VOLTage[:LEVel][:IMMediate][:AMPLitude]', '_level'),
+        ('[SOURce:]CURRent[:LEVel][:IMMediate][:AMPLitude]?', '_level_q'),
+        ('[SOURce:]VOLTage[:LEVel][:IMMediate][:AMPLitude]?', '_level_q'),
+        ('[SOURce:]LIST:CURRent', '_list'), ('[SOURce:]LIST:VOLTage', '_list'),
+        ('[SOURce:]DELay', '_delay'), ('[SOURce:]DELay:AUTO', '_delay_auto'), ('TRIGger:COUNt', '_count'),
+        ('[SENSe:]VOLTage[:DC]:NPLCycles', '_nplc'), ('READ?', '_read'),
+    ]
+
+    def __init__(self, world, address):
+        super().__init__(world, address)
+        self.nplc = 1.
+        self._list_mode = False
+        self._list_values = []
+        self._source_delay = 0.
+        self._trigger_count = 1
+
+    def _function(self, args):
+        self.current_mode = args.strip('"').upper().startswith('CURR')
+
+    def _output(self, args):
+        self.output = _on_off(args)
+
+    def _mode(self, args):
+        self._list_mode = args.upper().startswith('LIST')
+
+    def _level(self, args):
+        self.SetLevel(_number(args))
+
+    def _level_q(self, args):
+        return f'{self.level:.6e}'
+
+    def _list(self, args):
+        self._list_values = [float(v) for v in args.split(',')]
+
+    def _delay(self, args):
+        self._source_delay = _number(args)
+
+    def _delay_auto(self, args):
+        if _on_off(args):
+            self._source_delay = 0.  # an auto delay is short at a fixed range
+
+    def _count(self, args):
+        self._trigger_count = int(_number(args))
+
+    def _nplc(self, args):
+        self.nplc = _number(args)
+
+    def _read(self, args):
+        world = self.world
+        reading_time = self._source_delay + 2 * self.nplc / 50 + 0.01  # with an auto zero
+        if not self._list_mode:
+            world.Wait(reading_time * self._trigger_count)
+            t = time.time()
+            return _format_values(world.VoltmeterReading(np.full(self._trigger_count, t)))
+        levels = np.array(self._list_values[:self._trigger_count])
+        times = time.time() + reading_time * np.arange(len(levels))
+        self._schedule = (np.hstack((times, [times[-1] + reading_time])), np.hstack((levels, [self.level])))
+        world.Wait(reading_time * len(levels))
+        return _format_values(world.VoltmeterReading(times + self._source_delay))
+
+
+# LakeShore 370 and 335: a temperature of a cryostat and its control.
+# A heater drives a temperature to a setpoint in a closed loop mode (CMODE 1).
+class SimLakeShore(SimInstrument):
+    def __init__(self, world, address):
+        super().__init__(world, address)
+        self.settings.update({'PID': '10,20,20', 'CMODE': '4'})
+
+    def _temperature(self, args):
+        return f'{self.world.Temperature():+.6e}'
+
+    def _setpoint(self, args):
+        self.settings['SETP'] = args
+        self.world.SetTemperatureControl(setpoint=_number(args))
+
+    def _cmode(self, args):
+        self.settings['CMODE'] = args
+        self.world.SetTemperatureControl(heater_on=int(_number(args)) == 1)
+
+
+class SimLakeShore370(SimLakeShore):
+    model_name = 'MODEL370'
+    commands = SimInstrument.commands + [('RDGK?', '_temperature'), ('SETP', '_setpoint'), ('CMODE', '_cmode')]
+
+    def __init__(self, world, address):
+        super().__init__(world, address)
+        self.settings.update({'RDGRNG': '0,3,14,1,0', 'CSET': '6,1,1,0,1,8,100.0'})
+
+    def _execute(self, cmd):
+        # settings of a channel, e.g. "RDGRNG? 6", are stored without it
+        super()._execute(re.sub(r'^(RDGRNG\??) \d+,?\s*', r'\1 ', cmd))
+
+
+class SimLakeShore335(SimLakeShore):
+    model_name = 'MODEL335'
+    commands = SimInstrument.commands + [('KRDG?', '_temperature'), ('SETP', '_setpoint'), ('CMODE', '_cmode')]
+
+    def __init__(self, world, address):
+        super().__init__(world, address)
+        self.settings.update({'INTYPE': '1,0,1,0,1', 'PID': '5,2,0'})
+
+    def _execute(self, cmd):
+        super()._execute(re.sub(r'^(INTYPE\??|PID\??|RANGE\??) [AB12],?\s*', r'\1 ', cmd))
+
+
+class SimAMI430(SimInstrument):
+    model_name = 'AMI430'
+    coil_constant = 1.068  # kG/A
+    commands = SimInstrument.commands + [
+        ('CONFigure:FIELD:TARGet', '_target'), ('RAMP', '_ramp'), ('ZERO', '_zero'),
+        ('CURRent:MAGnet?', '_current'), ('FIELD:MAGnet?', '_field'), ('STATE?', '_state'),
+    ]
+
+    def __init__(self, world, address):
+        super().__init__(world, address)
+        self._target_field = 0.
+
+    def _target(self, args):
+        self._target_field = _number(args)
+
+    def _ramp(self, args):
+        self.world.field = self._target_field * 1e+3  # kG -> G
+
+    def _zero(self, args):
+        self.world.field = 0.
+
+    def _current(self, args):
+        return f'{self.world.field * 1e-3 / self.coil_constant:.6e}'
+
+    def _field(self, args):
+        return f'{self.world.field * 1e-3:.6e}'
+
+    def _state(self, args):
+        return '2'  # holding
+
+
+class SimKeysightN51(SimInstrument):
+    model_name = 'N5183B'
+    commands = SimInstrument.commands + [
+        ('[SOURce:]FREQuency[:FIXed]', '_frequency'), ('[SOURce:]POWer[:LEVel][:IMMediate][:AMPLitude]', '_power'),
+        ('OUTPut[:STATe]', '_output'),
+    ]
+    units = {'HZ': 1, 'KHZ': 1e+3, 'MHZ': 1e+6, 'GHZ': 1e+9}
+
+    def _frequency(self, args):
+        unit = re.sub(r'[-+\d.eE\s]', '', args).upper()
+        self.world.rf_frequency = _number(args) * self.units.get(unit, 1)
+
+    def _power(self, args):
+        self.world.rf_power = _number(args)
+
+    def _output(self, args):
+        self.world.rf_on = _on_off(args)
+
+
+class SimKeysightAWG(SimInstrument):
+    model_name = '33500B'
+    commands = SimInstrument.commands + [
+        ('OUTPut#', '_output'), ('APPLy:SQUare', '_apply_square'),
+        ('[SOURce:]VOLTage#:LEVel:HIGH', '_high'), ('[SOURce:]VOLTage#:LEVel:LOW', '_low'),
+        ('[SOURce:]FUNCtion#?', '_function_q'), ('[SOURce:]PERiod?', '_period_q'),
+        ('[SOURce:]VOLTage#:LEVel:HIGH?', '_high_q'), ('[SOURce:]FUNCtion#:SQUare:DCYCle?', '_duty_cycle_q'),
+    ]
+
+    def _output(self, args, channel):
+        self.world.awg['output'] = _on_off(args)
+
+    def _apply_square(self, args):
+        freq, amplitude, offset = (_number(a) for a in args.split(','))
+        self.world.awg.update(frequency=freq, high=offset + amplitude / 2, low=offset - amplitude / 2)
+
+    def _high(self, args, channel):
+        self.world.awg['high'] = _number(args)
+
+    def _low(self, args, channel):
+        self.world.awg['low'] = _number(args)
+
+    def _function_q(self, args, channel):
+        return 'SQU'
+
+    def _period_q(self, args):
+        return f'{1 / self.world.awg["frequency"]:.6e}'
+
+    def _high_q(self, args, channel):
+        return f'{self.world.awg["high"]:.6e}'
+
+    def _duty_cycle_q(self, args, channel):
+        return '5.000000e+01'
+
+
+# Simulated device models for driver classes
+SIM_MODELS = {
+    'YokogawaGS200': SimYokogawaGS200,
+    'Keithley6200': SimKeithley6200,
+    'Keithley2182A': SimKeithley2182A,
+    'Keithley2400': SimKeithley2400,
+    'LakeShore370': SimLakeShore370,
+    'LakeShore335': SimLakeShore335,
+    'AMI430': SimAMI430,
+    'KeysightN51': SimKeysightN51,
+    'KeysightAWG': SimKeysightAWG,
+}
+
+
+# A simulated VISA session with a PyVISA resource interface
+class SimResource:
+    def __init__(self, manager, device):
+        self._manager = manager
+        self.device = device
+        self.timeout = 2000  # milliseconds, as PyVISA
+
+    def write(self, message):
+        self._manager.Transaction(message)
+        self.device.Write(message)
+
+    def read(self):
+        return self.device.Read()
+
+    def query(self, message):
+        self.write(message)
+        return self.read()
+
+    def query_ascii_values(self, message, container=list, separator=','):
+        resp = self.query(message)
+        return container([float(v) for v in resp.split(separator) if v.strip()])
+
+    # Simulated devices send text in any data format, so binary blocks are not encoded
+    def query_binary_values(self, message, datatype='d', is_big_endian=False, header_fmt='ieee', container=list):
+        return self.query_ascii_values(message, container=container)
+
+    def clear(self):
+        self.device.Clear()
+
+    def close(self):
+        pass
+
+
+# A VISA resource manager with simulated devices.
+# latency - a time of one bus transaction, seconds;
+# command_latency - {header regular expression: latency} for commands which take another time;
+# timeout_rate - a probability of a simulated timeout of a transaction, to test error handling.
+class SimResourceManager:
+    wants_driver_names = True  # see visa_device.UseResourceManager
+
+    def __init__(self, world, latency=2e-3, command_latency=None, timeout_rate=0.):
+        self.world = world
+        self.latency = latency
+        self.command_latency = [(re.compile(p, re.IGNORECASE), t) for p, t in (command_latency or {}).items()]
+        self.timeout_rate = timeout_rate
+
+    def open_resource(self, address, driver_names=()):
+        model = next((SIM_MODELS[n] for n in driver_names if n in SIM_MODELS), SimInstrument)
+        device = model(self.world, address)
+        self.world.AddInstrument(address, device)
+        print(f'Simulator: {address} is a simulated {model.model_name}')
+        return SimResource(self, device)
+
+    def Transaction(self, message):
+        latency = self.latency
+        for regex, t in self.command_latency:
+            if regex.match(message.lstrip(':')):
+                latency = t
+                break
+        if latency > 0:
+            time.sleep(latency)
+        if self.timeout_rate and self.world.rng.random() < self.timeout_rate:
+            raise visa_device.VisaIOError(visa_device.VI_ERROR_TMO)
+
+    def list_resources(self):
+        return tuple(self.world.instruments)
+
+    def close(self):
+        pass
+
+
+# A function of a simulated DLL, accepts ctypes argtypes and restype like a real one
+class _DllFunction:
+    def __init__(self, func):
+        self.func = func
+        self.argtypes = None
+        self.restype = None
+
+    def __call__(self, *args):
+        return self.func(*args)
+
+
+# A simulated Leonardo_wrapper.dll: blocks of data are produced with a board sample rate,
+# a signal channel has an amplified sample voltage, all channels have noise
+class SimLeonardoLibrary:
+    def __init__(self, world):
+        self.world = world
+        self.InitBoard = _DllFunction(lambda handle, n: self._init(handle, n, Leonardo.LEONARDO_SAMPLE_FREQ, 0xFF))
+        self.InitBoardEx = _DllFunction(self._init)
+        self.PerformRead = _DllFunction(self._read)
+        self.FreeBoard = _DllFunction(lambda handle: 0)
+        self._channels = list(range(Leonardo.LEONARDO_MAX_CHANNELS))
+        self._rate = Leonardo.LEONARDO_SAMPLE_FREQ
+        self._t_next = 0.
+
+    def _init(self, handle, n_samples, rate, mask):
+        self._channels = [ch for ch in range(Leonardo.LEONARDO_MAX_CHANNELS) if mask & (1 << ch)]
+        if not self._channels:
+            return 0xFFFF0002  # WRAPPER_ERROR_NO_CHANNELS
+        self._rate = rate
+        self._t_next = time.time()
+        handle.value = 1
+        return 0
+
+    # A block begins when a previous one ended, or now if a board was idle (it is not read continuously)
+    def _read(self, handle, ptr, n_samples):
+        t_start = max(self._t_next, time.time() - n_samples / self._rate)
+        t = t_start + np.arange(n_samples) / self._rate
+        self._t_next = t_start + n_samples / self._rate
+        out = np.ctypeslib.as_array(ptr, shape=(n_samples * len(self._channels),))
+        out[:] = self.world.AdcVoltages(self._channels, t).ravel()
+        self.world.Wait(self._t_next - time.time())
+        return 0
+
+
+_world = None
+
+
+def GetWorld():
+    return _world
+
+
+# Makes all devices created later simulated. Returns a world state, which may be changed to set up an experiment.
+# sample - a sample model, a Josephson junction with default parameters if None (see SampleModel)
+def EnableSimulation(latency=2e-3, command_latency=None, time_scale=1., timeout_rate=0., sample=None):
+    global _world
+    if _world is None:
+        _world = SimWorld(time_scale)
+        if sample is None:
+            from Drivers.SampleModel import JosephsonJunction
+            sample = JosephsonJunction()
+        _world.sample = sample
+        visa_device.UseResourceManager(SimResourceManager(_world, latency, command_latency, timeout_rate))
+        Leonardo.UseLibrary(SimLeonardoLibrary(_world))
+        print('Simulation mode: all devices are simulated')
+    return _world
+
+
+# Sets parameters of a simulated setup, e.g. by EquipmentBase. excitation - a driver which drives a sample current.
+def ConfigureSimulation(bias_resistance=None, gain=None, excitation=None):
+    world = _world
+    if world is None:
+        return
+    if bias_resistance is not None:
+        world.bias_resistance = bias_resistance
+    if gain is not None:
+        world.gain = gain
+    if excitation is not None and hasattr(excitation, 'address'):
+        world.SetRole('excitation', excitation.address)
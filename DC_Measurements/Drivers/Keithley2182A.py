@@ -1,30 +1,82 @@
 from Drivers import visa_device
+import numpy as np
 
 
 class Keithley2182A(visa_device.visa_device):
+    binary_format = 'FORMat:DATA DREal;:FORMat:BORDer SWAPped'
+    binary_datatype = 'd'
+    buffer_max_points = 1024  # size of a reading buffer
+    nplc = 5  # integration time, power line cycles
+
     def __init__(self, device_num):
         print('Connecting Keithley 2182A series, ddevice id = ', device_num)
 
         super().__init__(device_num)
-        self.SendString('SENSe:VOLTage')
-        self.SendString('SENSe:CHANnel 1')
-        self.SendString('SENSe:VOLTage:NPLCycles 5')
-        self.SendString('SYSTem:FAZero OFF')
-        self.SendString('SYSTem:AZERo OFF')
-        self.SendString('SYSTem:LSYNc ON')
-        self.SendString('SENSe:VOLTage:CHANnel1:RANGe:AUTO ON')
-        self.SendString('SENSe:VOLTage:CHANnel1:LPASs OFF')
-        # self.SendString('OUTPut:RELative ON')
-        self.SendString('INITiate')
-        self.SendString('INITiate:CONTinuous OFF')
-        self._set_channel(1)
-
+        self._configure()
         print('Keithley 2182A series connection success')
 
+    def _configure(self):
+        with self.Batch():
+            self.SendString('SENSe:VOLTage')
+            self.SendString(f'SENSe:VOLTage:NPLCycles {self.nplc}')
+            self.SendString('SYSTem:FAZero OFF')
+            self.SendString('SYSTem:AZERo OFF')
+            self.SendString('SYSTem:LSYNc ON')
+            self.SendString('SENSe:VOLTage:CHANnel1:RANGe:AUTO ON')
+            self.SendString('SENSe:VOLTage:CHANnel1:LPASs OFF')
+            # self.SendString('OUTPut:RELative ON')
+            self.SendString('INITiate')
+            self.SendString('INITiate:CONTinuous OFF')
+            self._set_channel(1)
+
+    # Sets all settings again, e.g. after a device was controlled by Keithley 6221 (delta modes) via RS-232
+    def Restore(self):
+        self.InvalidateCached()
+        self._configure()
+
     def _set_channel(self, channel):
         self._channel = channel
-        self.SendString(f'SENSe:CHANnel {channel}')
-        self.SendString('INITiate:CONTinuous OFF')
+        if self.SendCached('channel', f'SENSe:CHANnel {channel}'):
+            self.SendString('INITiate:CONTinuous OFF')
+
+    # Approximate time of one reading, seconds
+    @property
+    def ReadingTime(self):
+        return self.nplc / 50 + 0.01
+
+    # Prepares a buffered acquisition: one reading per external trigger (Trigger Link) is stored in a buffer,
+    # n_points readings are taken, each one delay seconds after a trigger.
+    def ArmBuffer(self, n_points, channel, delay=0):
+        if channel != self._channel:
+            self._set_channel(channel)
+        with self.Batch():
+            self.SendString('TRACe:CLEar')
+            self.SendString(f'TRACe:POINts {n_points}')
+            self.SendString('TRACe:FEED SENSe')
+            self.SendString('TRACe:FEED:CONTrol NEXT')
+            self.SendString('TRIGger:SOURce EXTernal')
+            self.SendString(f'TRIGger:DELay {delay}')
+            self.SendString(f'TRIGger:COUNt {n_points}')
+            self.SendString('INITiate')
+
+    # Waits until n_points readings are stored (no more than timeout seconds) and returns them.
+    # Always returns n_points values: readings which were not taken in time (or could not be read) are NaN,
+    # so missing points of a sweep remain in data.
+    def ReadBuffer(self, n_points, timeout):
+        self._wait_buffer_points(n_points, timeout)
+        readings = self.GetFloatArray('TRACe:DATA?')[:n_points]
+        if len(readings) < n_points:
+            print(f'Warning! Only {len(readings)} of {n_points} buffered readings were taken')
+            readings = np.concatenate((readings, np.full(n_points - len(readings), np.nan)))
+        return readings
+
+    # Returns to single immediate readings
+    def DisarmBuffer(self):
+        with self.Batch():
+            self.SendString('TRACe:FEED:CONTrol NEVer')
+            self.SendString('TRIGger:SOURce IMMediate')
+            self.SendString('TRIGger:DELay 0')
+            self.SendString('TRIGger:COUNt 1')
 
     # returns voltage in volts
     def MeasureNow(self, channel):
@@ -1,5 +1,6 @@
 from Drivers import visa_device
 from enum import Enum
+import numpy as np
 
 class Keithley2400WorkMode(Enum):
     MODE_SOURCE = 0
@@ -8,6 +9,11 @@ class Keithley2400WorkMode(Enum):
 
 
 class Keithley2400(visa_device.visa_device):
+    list_max_points = 100  # maximal length of a source list
+    nplc = 5  # integration time, power line cycles
+    binary_format = 'FORMat:DATA REAL,32;:FORMat:BORDer SWAPped'  # the 2400 has no 64-bit format
+    binary_datatype = 'f'
+
     def __init__(self, device_num, mode: Keithley2400WorkMode, R=None, what='CURR', max_current=2E-5):
         modes_UI = {Keithley2400WorkMode.MODE_SOURCE: "Current source",
                     Keithley2400WorkMode.MODE_VOLTMETER: "Voltmeter",
@@ -31,40 +37,90 @@ class Keithley2400(visa_device.visa_device):
             raise ValueError('Please specify a resistance for a voltage sweep mode')
 
         super().__init__(device_num)
-        if mode != Keithley2400WorkMode.MODE_SOURCE:  # voltmeter or both
-            self.SendString('SENSe:FUNCtion:OFF:ALL')
-            self.SendString('SENSe:FUNCtion VOLTage')
-            self.SendString('SENSe:VOLTage:NPLCycles 5')
-            self.SendString('SENSe:VOLTage:PROTection 15')  # 15 volts
-            self.SendString('FORMat:ELEMents VOLTage')
-            self.SendString('SYSTem:AZERo OFF')
-
-        if mode == Keithley2400WorkMode.MODE_BOTH:
-            self.SendString('SYSTem:RSENse:ON')  # remote sense (4-wire schene)
-
-        if mode != Keithley2400WorkMode.MODE_VOLTMETER:  # source or both
-            self.SendString(f'SOURce:FUNCtion "{func}"')
-            self.SendString('SOURce:{func}:RANGe:AUTO OFF')
-            self.SendString(f'SOURce:{func}:RANGe {max_current}')
-            self.SendString(f'SOURce:{func}:MODE FIXed')  # TODO check!
-            self.SendString('OUTPut ON')
+        self._sync_pending = False  # a level was sent, but it is not known whether it is already set
+        with self.Batch():
+            if mode != Keithley2400WorkMode.MODE_SOURCE:  # voltmeter or both
+                self.SendString('SENSe:FUNCtion:OFF:ALL')
+                self.SendString('SENSe:FUNCtion VOLTage')
+                self.SendString(f'SENSe:VOLTage:NPLCycles {self.nplc}')
+                self.SendString('SENSe:VOLTage:PROTection 15')  # 15 volts
+                self.SendString('FORMat:ELEMents VOLTage')
+                self.SendString('SYSTem:AZERo OFF')
+
+            if mode == Keithley2400WorkMode.MODE_BOTH:
+                self.SendString('SYSTem:RSENse ON')  # remote sense (4-wire schene)
+
+            if mode != Keithley2400WorkMode.MODE_VOLTMETER:  # source or both
+                self.SendString(f'SOURce:FUNCtion "{func}"')
+                self.SendString(f'SOURce:{func}:RANGe:AUTO OFF')
+                self.SendString(f'SOURce:{func}:RANGe {max_current}')
+                self.SendString(f'SOURce:{func}:MODE FIXed')  # TODO check!
+                self.SendCached('output', 'OUTPut ON')
 
         self._mode = mode
 
         print('Keithley 2400 series connection success')
 
+    # A device executes commands in order, so a reading is taken after a level was set
     def MeasureNow(self, channel=None):
+        self._sync_pending = False
         return self.GetFloat(':READ?')
 
+    # Waits until all sent commands are executed, e.g. before a measurement by another device
+    def Synchronize(self):
+        if self._sync_pending:
+            self.GetString('*OPC?')
+            self._sync_pending = False
+
     # value in volts or amperes
     def SetOutput(self, value: float):
         if self._volt_mode:
             value /= self.R  # volts -> amperes
 
         func = self._func_for_cmd
-        self.SendString(f'SOURce:{func}:LEVel {value}')
-        self.SendString('*OPC?')
+        if self.SendCached('level', f'SOURce:{func}:LEVel {value}'):
+            self._sync_pending = True  # see Synchronize
+
+    # Hardware list sweep (for MODE_BOTH).
+    # Values (in volts or amperes) are uploaded as a source list, a device steps through it by itself
+    # with a source delay (seconds) before each reading, and all readings are returned in one transfer.
+    # Long sequences are split into lists of list_max_points, readings of each list are yielded as an array.
+    def SweepListChunks(self, values, delay):
+        if self._mode != Keithley2400WorkMode.MODE_BOTH:
+            raise ValueError('A hardware sweep requires Keithley 2400 to be a source and a voltmeter')
+        values = np.asarray(values, dtype=float)
+        if self._volt_mode:
+            values = values / self.R  # volts -> amperes
+
+        func = self._func_for_cmd
+        with self.Batch():
+            self._use_format(binary=True)  # readings of all lists are transferred as binary blocks
+            self.SendString(f'SOURce:{func}:MODE LIST')
+            self.SendString(f'SOURce:DELay {delay}')
+        last_value = None
+        try:
+            for start in range(0, len(values), self.list_max_points):
+                chunk = values[start: start + self.list_max_points]
+                with self.Batch():
+                    self.SendString(f'SOURce:LIST:{func} ' + ','.join(f'{v:.6e}' for v in chunk))
+                    self.SendString(f'TRIGger:COUNt {len(chunk)}')
+
+                # a time of one point is a source delay plus a measurement (integration, auto zero)
+                point_time = delay + 2 * self.nplc / 50 + 0.01
+                readings = self.GetFloatArray(':READ?', timeout=len(chunk) * point_time + 5)
+                last_value = chunk[-1]
+                yield readings
+        finally:
+            # return to a fixed level mode with an auto source delay (as MeasureNow expects), keep the last list value
+            with self.Batch():
+                self.SendString(f'SOURce:{func}:MODE FIXed')
+                self.SendString('SOURce:DELay:AUTO ON')
+                self.SendString('TRIGger:COUNt 1')
+                self.InvalidateCached('level')
+                if last_value is not None:
+                    self.SendCached('level', f'SOURce:{func}:LEVel {last_value}')
 
     def GetOutput(self):
         func = self._func_for_cmd
+        self._sync_pending = False
         return self.GetFloat(f'SOURce:{func}:LEVel?')
@@ -4,6 +4,10 @@ import numpy as np
 
 
 class Keithley6200(visa_device.visa_device):
+    state_reset_commands = visa_device.visa_device.state_reset_commands + ('CLE',)  # CLEar turns output off
+    list_command_points = 100  # maximal number of values in one SOURce:LIST command
+    delta_reading_time = 0.5  # upper estimate of one delta mode reading time without a delay, seconds
+
     def __init__(self, device_num, R=None, what='CURR', max_current=2E-5):
         print('Connecting Keithley 6200 series, device id = ', device_num)
         if what not in ['VOLT', 'CURR']:
@@ -15,27 +19,136 @@ class Keithley6200(visa_device.visa_device):
             raise ValueError('Please specify a resistance for a voltage sweep mode')
 
         super().__init__(device_num)
-        self.SendString('CLEar')
-        self.SendString('CURRent:FILTer ON')
-        self.SendString('CURRent:RANGe:AUTO OFF')
-        self.SendString('OUTPut:ISHield OLOW')
-        self.SendString('OUTPut:LTEarth OFF')
-
-        self.SendString('CURRent:COMPliance 15')
-        self.SendString(f'CURRent:RANGe {max_current}')
-        self.SendString('OUTPut ON')
+        with self.Batch():
+            self.SendString('CLEar')
+            self.SendString('CURRent:FILTer ON')
+            self.SendString('CURRent:RANGe:AUTO OFF')
+            self.SendString('OUTPut:ISHield OLOW')
+            self.SendString('OUTPut:LTEarth OFF')
+
+            self.SendString('CURRent:COMPliance 15')
+            self.SendString(f'CURRent:RANGe {max_current}')
+            self.SendCached('output', 'OUTPut ON')
         print('Keithley 6200 series init success')
 
     # value in volts or amperes
     def SetOutput(self, value: float):
         if self._volt_mode:
             value /= self.R  # volts -> amperes
-        self.SendString('OUTPut ON')
-        self.SendString(f'CURRent {value}')
+        with self.Batch():  # one bus transaction, or none if nothing was changed
+            self.SendCached('output', 'OUTPut ON')
+            self.SendCached('level', f'CURRent {value}')
 
     def GetOutput(self):
         return self.GetFloat('CURRent?')
 
+    def _to_current(self, value):
+        return value / self.R if self._volt_mode else value  # volts -> amperes
+
+    # Delta and differential conductance modes require Keithley 6221 with Keithley 2182A connected by RS-232
+    # (and Trigger Link), the 6221 controls a voltmeter by itself and stores readings in its buffer.
+    def _check_nanovoltmeter(self):
+        if self.GetString('SOURce:DELTa:NVPResent?').strip() != '1':
+            raise RuntimeError('Keithley 2182A is not connected to Keithley 6221 by RS-232')
+
+    def _run_delta_mode(self, mode, settings, n_points, timeout, unit='OHMS'):
+        self._check_nanovoltmeter()
+        with self.Batch():
+            self.SendString('SOURce:SWEep:ABORt')
+            self.SendString('FORMat:ELEMents READing')
+            self.SendString(f'UNIT {unit}')
+            for cmd in settings:
+                self.SendString(f'SOURce:{mode}:{cmd}')
+            self.SendString('TRACe:CLEar')
+            self.SendString(f'TRACe:POINts {n_points}')
+            self.SendString(f'SOURce:{mode}:ARM')
+            self.SendString('INITiate:IMMediate')
+
+        self._wait_buffer_points(n_points, timeout)
+        readings = self.GetFloatArray('TRACe:DATA?')
+        self.SendString('SOURce:SWEep:ABORt')
+        self.InvalidateCached('level')  # a device returns to a zero or bias level
+        return readings
+
+    # Delta mode: a current alternates between +current and -current, each reading is a resistance
+    # computed from three voltage readings, so thermoelectric EMFs and their drifts are cancelled.
+    # current is in volts or amperes, delay - a delay after each current change, seconds.
+    # Returns an array of n_points resistances, ohms.
+    def MeasureDelta(self, current, n_points, delay=2E-3):
+        current = self._to_current(current)
+        settings = [f'HIGH {current}', f'LOW {-current}', f'DELay {delay}', f'COUNt {n_points}',
+                    'CABort ON']  # abort on compliance
+        timeout = n_points * (delay + self.delta_reading_time) + 5
+        return self._run_delta_mode('DELTa', settings, n_points, timeout)
+
+    # Differential conductance mode: a staircase from start to stop with a step, with an alternating
+    # component +-delta added, gives dV/dI at each step by a delta technique.
+    # All values are in volts or amperes, delay - a delay after each current change, seconds.
+    # Returns arrays (staircase values, dV/dI in ohms).
+    def MeasureDifferentialConductance(self, start, stop, step, delta, delay=2E-3):
+        n_points = int(round((stop - start) / step)) + 1
+        values = start + step * np.arange(n_points)
+        start, stop, step, delta = (self._to_current(v) for v in (start, stop, step, delta))
+        settings = [f'STARt {start}', f'STEP {step}', f'STOP {stop}', f'DELTa {delta}', f'DELay {delay}',
+                    'CABort ON']
+        timeout = n_points * (delay + self.delta_reading_time) + 5
+        return values, self._run_delta_mode('DCONductance', settings, n_points, timeout)
+
+    # Pulsed I-V (pulse delta mode with a list sweep): a current is a pulse of each value (volts or amperes)
+    # with a width (seconds, 50 us...12 ms) over a zero level, pulses are repeated every interval power line cycles.
+    # A voltage is measured inside each pulse and between pulses, a difference is returned,
+    # so a sample is heated only for a small duty cycle.
+    # Returns an array of voltages, volts.
+    def MeasurePulsedSweep(self, values, width, interval=5):
+        currents = self._to_current(np.asarray(values, dtype=float))
+        n_points = len(currents)
+        with self.Batch():
+            self.SendString('SOURce:SWEep:SPACing LIST')
+            self._send_list('CURRent', currents)
+            self.SendString('SOURce:SWEep:RANGing BEST')
+            self.SendString('SOURce:SWEep:COUNt 1')
+        settings = ['SWEep ON', 'LOW 0', f'WIDTh {width}', f'INTerval {int(interval)}', 'LMEasure 2',
+                    f'COUNt {n_points}']
+        timeout = n_points * (interval / 50 + self.delta_reading_time) + 5
+        return self._run_delta_mode('PDELta', settings, n_points, timeout, unit='VOLTs')
+
+    # Sends a list of values by SOURce:LIST:<what> commands, appending if a list is longer than one command allows
+    def _send_list(self, what, values):
+        n = self.list_command_points
+        for start in range(0, len(values), n):
+            cmd = f'SOURce:LIST:{what}' if start == 0 else f'SOURce:LIST:{what}:APPend'
+            self.SendString(cmd + ' ' + ','.join(f'{v:.6e}' for v in values[start: start + n]))
+
+    # Prepares a list sweep stepped over Trigger Link (a voltmeter, e.g. Keithley 2182A, must be connected):
+    # at each step a current source waits delay seconds, sends a trigger to a voltmeter on out_line,
+    # and waits for a measurement complete signal from it on in_line before the next step.
+    # Values are in volts or amperes. A sweep begins after StartArmedSweep.
+    def ArmListSweep(self, values, delay, out_line=2, in_line=1):
+        values = np.asarray(values, dtype=float)
+        if self._volt_mode:
+            values = values / self.R  # volts -> amperes
+        with self.Batch():
+            self.SendString('SOURce:SWEep:SPACing LIST')
+            self._send_list('CURRent', values)
+            self._send_list('DELay', np.full(len(values), max(delay, 1E-3)))  # 1 ms is a minimal delay
+            self.SendString('SOURce:SWEep:RANGing FIXed')
+            self.SendString('SOURce:SWEep:COUNt 1')
+            self.SendString('TRIGger:SOURce TLINk')
+            self.SendString('TRIGger:DIRection SOURce')  # the first step does not wait for an input trigger
+            self.SendString(f'TRIGger:OLINe {out_line}')
+            self.SendString(f'TRIGger:ILINe {in_line}')
+            self.SendString('TRIGger:OUTPut DEL')  # output trigger after a source delay
+            self.SendString('SOURce:SWEep:ARM')
+
+    def StartArmedSweep(self):
+        self.SendString('INITiate:IMMediate')
+
+    # Finishes a sweep, a device returns to its fixed level (the last SetOutput value)
+    def AbortSweep(self):
+        with self.Batch():
+            self.SendString('SOURce:SWEep:ABORt')
+            self.SendString('TRIGger:SOURce IMMediate')
+
 
 class DebugKeithley6200:
     def __init__(self, device_num):
@@ -52,6 +52,7 @@ class KeysightAWG(visa_device.visa_device):
         self.SendString('OUTput1 OFF')
         self.SendString('BURS1:STATe OFF')
         print('Keysight AWG disconnecting, output was set to 0')
+        super().__del__()
 
 
 # for debugging purposes, no real device
@@ -62,6 +62,7 @@ class KeysightN51(visa_device.visa_device):
     def __del__(self):
         print('Keysight generator output off.')
         self.OutputOff()
+        super().__del__()
 
 
 class DebugKeysightN51:
@@ -30,17 +30,17 @@ class LakeShore335(LakeShoreBase):
     # device parameter setters
     def _set_pid(self, pid):
         chan = self._heater_channel
-        self.device.write(f'PID {chan},{pid}')
+        self.SendCached(f'PID {chan}', f'PID {chan},{pid}')
         super()._set_pid(pid)
 
     def _set_heater_range(self, htrrng):
         chan = self._heater_channel
-        self.device.write(f'RANGE {chan},{htrrng}')
+        self.SendCached(f'RANGE {chan}', f'RANGE {chan},{htrrng}')
         super()._set_heater_range(htrrng)
 
     def _set_excitation(self, excitation):
         chan = self._temp_channel
-        self.device.write(f'INTYPE {chan},{self._intype_sensor_type},{self._intype_autorange},{excitation},{self._intype_compensation},{self._intype_units}')
+        self.SendCached(f'INTYPE {chan}', f'INTYPE {chan},{self._intype_sensor_type},{self._intype_autorange},{excitation},{self._intype_compensation},{self._intype_units}')
         super()._set_excitation(excitation)
 
     def _set_channel(self, chan):
@@ -81,7 +81,7 @@ class LakeShore335(LakeShoreBase):
     # Changes a setpoint
     def _set_setpoint(self, setp):
         chan = self._heater_channel
-        self.SendString(f'SETP {setp}')
+        self.SendCached('SETP', f'SETP {setp}')
 
     def _set_control_mode(self, mode: PIDLoopType):
         # in a device: 1 - closed loop, 3 - open loop, 4 = off
@@ -89,5 +89,5 @@ class LakeShore335(LakeShoreBase):
                            PIDLoopType.close_loop: 1,
                            PIDLoopType.off: 4}
 
-        self.SendString(f'CMODE {class_to_device[mode]}')
+        self.SendCached('CMODE', f'CMODE {class_to_device[mode]}')
 
@@ -17,21 +17,21 @@ class LakeShore370(LakeShoreBase):
 
     # device parameter setters
     def _set_pid(self, pid):
-        self.device.write(f'PID {pid}')
+        self.SendCached('PID', f'PID {pid}')
         super()._set_pid(pid)
 
     def _set_heater_range(self, htrrng):
-        self.device.write(f'HTRRNG {htrrng}')
+        self.SendCached('HTRRNG', f'HTRRNG {htrrng}')
         super()._set_heater_range(htrrng)
 
     def _set_excitation(self, excitation):
-        self.device.write(
+        self.SendCached(f'RDGRNG {self._temp_channel}',
             f'RDGRNG {self._temp_channel}, 0, {excitation}, 14, 1, 0')  # 6 chan, 0 - voltage exc.,
                                                 # n_setting, 14 - 6.32 kOhm, 1 - autorange on, 0 - excitation on(!!!)
         super()._set_excitation(excitation)
         
     def _set_channel(self, chan):
-        self.SendString(f'SCAN {chan},0')
+        self.SendCached('SCAN', f'SCAN {chan},0')
         super()._set_channel(chan)
 
     # Functions for updating LakeShore params depending on temperature
@@ -71,7 +71,7 @@ class LakeShore370(LakeShoreBase):
         self.__pid = self.__old_pid
 
     def _restore_old_params(self):
-        self.device.write(f'RDGRNG {self._temp_channel}, {self.__old_settings}')
+        self.SendCached(f'RDGRNG {self._temp_channel}', f'RDGRNG {self._temp_channel}, {self.__old_settings}')
         self._set_pid(self.__old_pid)
 
     # Prints current controller parameters
@@ -106,7 +106,7 @@ class LakeShore370(LakeShoreBase):
 
     # Changes a setpoint
     def _set_setpoint(self, setp):
-        self.SendString(f'SETP {setp}')
+        self.SendCached('SETP', f'SETP {setp}')
 
     def _set_control_mode(self, mode:PIDLoopType):
         # in a device: 1 - closed loop, 3 - open loop, 4 = off
@@ -114,7 +114,7 @@ class LakeShore370(LakeShoreBase):
                            PIDLoopType.close_loop: 1,
                            PIDLoopType.off: 4}
 
-        self.SendString(f'CMODE {class_to_device[mode]}')
+        self.SendCached('CMODE', f'CMODE {class_to_device[mode]}')
 
 
 # for debugging purposes, doesn't actually change or measure a temperature
@@ -139,7 +139,7 @@ class DebugLakeShore370:
         self.__dummy_temp = self.__temp_channel
         print('Scanning', chan, 'channel')
     
-    def GetTemperature(self):
+    def GetTemperature(self, max_age=None):
         return self.__dummy_temp
 
     @property
@@ -3,6 +3,8 @@ from Lib.lm_utils import *
 import numpy as np
 import time
 import threading
+import weakref
+from collections import deque
 from enum import Enum
 
 
@@ -12,6 +14,22 @@ class LakeShoreException(Exception):
         super().__init__("Temperature sweep is allowed only in active mode")
 
 
+# Reads a temperature periodically in a background thread and publishes it to a LakeShore object.
+# The thread holds only a weak reference, so it stops when an object is deleted (or StopPolling is called).
+def _poller_thread_proc(lakeshore_ref, stop):
+    while not stop.is_set():
+        lakeshore = lakeshore_ref()
+        if lakeshore is None:
+            return
+        interval = lakeshore.poll_interval
+        try:
+            lakeshore._read_temperature()
+        except Exception as e:
+            print('Temperature polling error:', e)
+        del lakeshore  # do not keep an object alive while waiting
+        stop.wait(interval)
+
+
 # PID loop type
 class PIDLoopType(Enum):
     off = 0
@@ -20,6 +38,11 @@ class PIDLoopType(Enum):
 
 
 class LakeShoreBase(visa_device.visa_device):
+    batch_root = ''  # LakeShore commands are not SCPI, they have no command tree
+    poll_interval = 1.  # seconds between temperature readings of a background poller
+    min_read_interval = 1.  # seconds, a device stops responding if it is requested too often
+    history_length = 3600  # number of temperature readings kept in TemperatureHistory
+
     # device parameter setters
     # all of them must be overridden in child classes
     # and overriding methods must call super()._set_pid
@@ -98,31 +121,62 @@ class LakeShoreBase(visa_device.visa_device):
         # must be overridden in a child class
         return 0
 
-    def GetTemperature(self):
-        self.__SensorFree.wait()  # wait for another thread (if one present) to complete operation
-        self.__SensorFree.clear()  # lock for another threads
-
-        # check if previous request was too close in time
-        curr_meas = time.time()
-        if curr_meas - self.__prev_measured < 1:
-            time.sleep(1)
-        res = 0
-        count = 0
-        while res == 0 and count < 5:
-            time.sleep(0.5)
-            try:
-                resp = self._meas_temperature()
-                temp = np.float64(resp)
-                res = temp
-            except Exception:
-                res = 0
+    # Reads a temperature from a device (with several attempts) and publishes it.
+    # Device requests are serialised: one reading at a time, not more often than min_read_interval.
+    def _read_temperature(self):
+        with self.__read_lock:
+            wait = self.__prev_measured + self.min_read_interval - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            channel = self._temp_channel
+            res = np.nan  # returned if a temperature could not be measured
+            for attempt in range(5):
+                if attempt > 0:
+                    time.sleep(0.5)
+                try:
+                    res = np.float64(self._meas_temperature())
+                except Exception:
+                    res = np.nan
+                if IsValidTemperature(res):
+                    break
                 print('Error while measuring temperature')
-            count += 1
 
-        self.__prev_measured = time.time()
-        self.__SensorFree.set()  # unlock
+            self.__prev_measured = time.time()
+            reading = (self.__prev_measured, res, channel)
+            self.__latest = reading  # a tuple is replaced at once, so readers need no lock
+            self.__history.append(reading)
+            return res
+
+    # Returns the latest temperature published by a poller immediately.
+    # A new reading is made if there is none yet for a current channel, or it is older than max_age seconds.
+    def GetTemperature(self, max_age=None):
+        latest = self.__latest
+        if latest is None or latest[2] != self._temp_channel or \
+                (max_age is not None and time.time() - latest[0] > max_age):
+            return self._read_temperature()
+        return latest[1]
+
+    # Latest reading: (time.time(), temperature, channel), or None
+    @property
+    def LatestReading(self):
+        return self.__latest
+
+    # Recent readings as a list of (time.time(), temperature, channel), the oldest first
+    @property
+    def TemperatureHistory(self):
+        return list(self.__history)
 
-        return res
+    # Starts a background temperature poller, GetTemperature returns its readings
+    def StartPolling(self):
+        if self.__poller is not None and self.__poller.is_alive():
+            return
+        self.__stop_polling.clear()
+        self.__poller = threading.Thread(target=_poller_thread_proc, args=(weakref.ref(self), self.__stop_polling),
+                                         daemon=True)
+        self.__poller.start()
+
+    def StopPolling(self):
+        self.__stop_polling.set()
 
     # Number of swept temperature values
     @property
@@ -186,6 +240,15 @@ class LakeShoreBase(visa_device.visa_device):
         self.__prev_measured = time.time()
         self.__prev_changed = time.time()
 
+        # A lock to prevent simultaneous temperature requests - they cause an error
+        self.__read_lock = threading.Lock()
+
+        # Published readings, see GetTemperature
+        self.__latest = None
+        self.__history = deque(maxlen=self.history_length)
+        self.__poller = None
+        self.__stop_polling = threading.Event()
+
         # Load and configure a device
         if self._verbose:
             print('Connecting LakeShore bridge, device ID = ', device_num)
@@ -193,10 +256,6 @@ class LakeShoreBase(visa_device.visa_device):
         # connect to device
         super().__init__(device_num)
 
-        # Event to prevent simultaneous temperature request - it will cause an error
-        self.__SensorFree = threading.Event()
-        self.__SensorFree.set()
-
         # remember current heater paramrters to restore them after program end
         self._remember_old_params()
 
@@ -213,6 +272,8 @@ class LakeShoreBase(visa_device.visa_device):
             # temperature swept values
             self._tempValues = np.hstack((np.arange(initialTemp, max_temp, temp_step), [max_temp]))
 
+        self.StartPolling()
+
         if self._verbose:
             print('LakeShore bridge connection success')
 
@@ -234,7 +295,7 @@ class LakeShoreBase(visa_device.visa_device):
 
             # Wait for temperature to be established
             c = 0
-            while abs(actual_temp - temp) >= tol_temp:
+            while not abs(actual_temp - temp) < tol_temp:  # NaN (a failed measurement) is not a correct value
                 time.sleep(1)
                 actual_temp = self.GetTemperature()
 
@@ -261,6 +322,8 @@ class LakeShoreBase(visa_device.visa_device):
 
     # class destructor - turn off a heater and free VISA resources
     def __del__(self):
+        self.StopPolling()
+
         # Turn off heater and PID control
         if self._active:
             self._set_heater_range(0)
@@ -272,3 +335,5 @@ class LakeShoreBase(visa_device.visa_device):
             if self._active:
                 print('Heater is off.')
                 print('Old heater range parameters restored.')
+
+        super().__del__()
@@ -1,5 +1,22 @@
 import numpy as np
 import ctypes
+import threading
+import time
+from collections import namedtuple
+
+LEONARDO_SAMPLE_FREQ = 102400.  # default samples per second for each channel, as in Leonardo_wrapper.cpp
+LEONARDO_MAX_CHANNELS = 8
+
+
+# A library with Leonardo_wrapper.dll functions, replaced e.g. by a simulated board (see UseLibrary)
+_library = None
+
+
+# Makes all Leonardo objects created later use a given library instead of Leonardo_wrapper.dll.
+# It must have InitBoard, PerformRead, FreeBoard (and optionally InitBoardEx) functions with DLL signatures.
+def UseLibrary(library):
+    global _library
+    _library = library
 
 
 class LeonardoInitException(Exception):
@@ -14,19 +31,85 @@ class LeonardoReadException(Exception):
         super().__init__(msg)
 
 
+# Statistics of one measured point for each channel: mean value, standard error of the mean,
+# minimum, maximum and number of samples. Every field is an array indexed by a channel number.
+LeonardoStats = namedtuple('LeonardoStats', ['mean', 'sem', 'min', 'max', 'n'])
+
+
+# Calculates statistics of a (samples, channels) block, column-wise
+def BlockStats(data):
+    n = data.shape[0]
+    mean = data.mean(axis=0)
+    sem = data.std(axis=0, ddof=1) / np.sqrt(n) if n > 1 else np.full(data.shape[1], np.nan)
+    return LeonardoStats(mean, sem, data.min(axis=0), data.max(axis=0), n)
+
+
+# Combines statistics of two parts of data (Chan et al. parallel algorithm).
+# A part is a tuple (n, mean, M2, min, max), where M2 is a sum of squared deviations from the mean.
+def _combine_parts(a, b):
+    n_a, mean_a, m2_a, min_a, max_a = a
+    n_b, mean_b, m2_b, min_b, max_b = b
+    n = n_a + n_b
+    delta = mean_b - mean_a
+    mean = mean_a + delta * (n_b / n)
+    m2 = m2_a + m2_b + delta ** 2 * (n_a * n_b / n)
+    return n, mean, m2, np.minimum(min_a, min_b), np.maximum(max_a, max_b)
+
+
+# Allocates an uninitialized float64 array whose data start is aligned to a given number of bytes
+# (a cache line by default), so a DMA copy made by a driver never straddles a line at the start
+def _aligned_empty(n_values, alignment=64):
+    itemsize = np.dtype(np.float64).itemsize
+    raw = np.empty(n_values * itemsize + alignment, dtype=np.uint8)
+    offset = (-raw.ctypes.data) % alignment
+    return raw[offset: offset + n_values * itemsize].view(np.float64)
+
+
+class LeonardoStreamException(Exception):
+    pass
+
+
+# Converts a channels argument (a number of first channels or a list of channel numbers)
+# into a sorted list of channel numbers
+def _channels_list(channels):
+    if isinstance(channels, int):
+        channels = range(channels)
+    channels = sorted(set(int(ch) for ch in channels))
+    if not channels or channels[0] < 0 or channels[-1] >= LEONARDO_MAX_CHANNELS:
+        raise ValueError(f'Leonardo channels must be in range 0...{LEONARDO_MAX_CHANNELS - 1}')
+    return channels
+
+
 class Leonardo:
-    def __init__(self, channels=8, n_samples=500, verbose=True):
-        self.__N_CHANNELS = channels
+    # channels - a number of first channels to be digitised, or a list of channel numbers, e.g. [4, 6].
+    # Only these channels are transferred from a board.
+    # sample_rate - samples per second for each channel
+    def __init__(self, channels=8, n_samples=500, verbose=True, sample_rate=LEONARDO_SAMPLE_FREQ):
+        self.__channels = _channels_list(channels)
         self.__verbose = verbose
         self.__points = n_samples
+        self.__sample_rate = sample_rate
 
         # Load wrapper DLL functions
-        dll = ctypes.WinDLL('Leonardo_wrapper.dll')
+        dll = _library if _library is not None else ctypes.WinDLL('Leonardo_wrapper.dll')
 
         self.InitBoard = dll.InitBoard
         self.InitBoard.argtypes = [ctypes.POINTER(ctypes.c_int), ctypes.c_int]
         self.InitBoard.restype = ctypes.c_uint
 
+        try:
+            self.InitBoardEx = dll.InitBoardEx
+            self.InitBoardEx.argtypes = [ctypes.POINTER(ctypes.c_int), ctypes.c_int, ctypes.c_double, ctypes.c_uint]
+            self.InitBoardEx.restype = ctypes.c_uint
+        except AttributeError:  # an old wrapper DLL, it always digitises all channels at a default rate
+            print('Warning! Leonardo_wrapper.dll does not support channel selection, please rebuild it.')
+            self.InitBoardEx = None
+            self.__channels = list(range(LEONARDO_MAX_CHANNELS))
+            self.__sample_rate = LEONARDO_SAMPLE_FREQ
+
+        self.__N_CHANNELS = len(self.__channels)
+        self.__columns = {ch: i for i, ch in enumerate(self.__channels)}  # channel number -> data column
+
         self.PerformRead = dll.PerformRead
         self.PerformRead.argtypes = [ctypes.c_uint, ctypes.POINTER(ctypes.c_double), ctypes.c_uint]
         self.PerformRead.restype = ctypes.c_uint
@@ -34,51 +117,351 @@ class Leonardo:
         self.FreeBoard = dll.FreeBoard
         self.FreeBoard.argtypes = [ctypes.c_uint]
 
+        # A reusable acquisition buffer: PerformRead writes directly into its memory,
+        # so no per-point allocation or copying is made
+        self.__buffer = _aligned_empty(self.__N_CHANNELS * n_samples)
+        self.__buffer_ptr = self.__buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_double))
+        self.__data = self.__buffer.reshape(-1, self.__N_CHANNELS)  # a view, (samples, channels)
+
+        # Streaming mode state (see StartStreaming)
+        self.__ring = None
+        self.__written = 0  # total number of samples written into a ring buffer since streaming start
+        self.__stream_t0 = 0  # time.time() of the first streamed sample
+        self.__stream_error = None
+        self.__stream_stop = threading.Event()
+        self.__stream_thread = None
+
+        self.__last_samples_used = n_samples  # samples averaged in the last measured point
+        self.__filters = []  # processing stages applied before averaging, see AddFilter
+
+        # Acquisition timings
+        self.__last_latency = 0  # seconds, the last read
+        self.__total_latency = 0
+        self.__n_reads = 0
+
         # Perform initialization steps
         if self.__verbose:
             print('Initializing Leonardo...')
-        nSamples = 16
+        # DMA block size is equal to a number of samples in one point,
+        # so one buffer-ready event delivers exactly one measurement point
+        nSamples = n_samples
         hDeviceC = ctypes.c_int()
-        ret = self.InitBoard(hDeviceC, nSamples)
+        if self.InitBoardEx is not None:
+            mask = sum(1 << ch for ch in self.__channels)
+            ret = self.InitBoardEx(hDeviceC, nSamples, self.__sample_rate, mask)
+        else:
+            ret = self.InitBoard(hDeviceC, nSamples)
         if ret == 0:
             if self.__verbose:
                 print('Leonardo init success')
             self.hDevice = hDeviceC.value
         else:
             raise LeonardoInitException(ret)
+        if self.__verbose:
+            print(f'Channels: {self.__channels}, sample rate: {self.__sample_rate} Hz')
+            print(f'DMA block is {nSamples} samples, {self.BlockDuration * 1e+3:.2f} ms')
 
-    def MeasureNow(self, channel):
-        nSamples = self.__points
-        buff = (ctypes.c_double * (self.__N_CHANNELS * nSamples))()
-        ret = self.PerformRead(self.hDevice, buff, nSamples)
-        if ret == 0:
-            data_read = np.array(buff).reshape(-1, self.__N_CHANNELS)
-            return np.average(data_read, 0)[channel]
+    # checks that a user-provided array can be filled by a driver directly
+    def _check_out(self, out):
+        if not isinstance(out, np.ndarray) or out.dtype != np.float64 or not out.flags['C_CONTIGUOUS'] \
+                or not out.flags['WRITEABLE']:
+            raise ValueError('Output array must be a writeable C-contiguous float64 numpy array')
+        if out.size != self.__N_CHANNELS * self.__points:
+            raise ValueError(f'Output array must have {self.__points}x{self.__N_CHANNELS} elements')
+
+    # Column of a channel in data returned by MeasureMany and GetSamples
+    def ChannelColumn(self, channel):
+        try:
+            return self.__columns[channel]
+        except KeyError:
+            raise ValueError(f'Leonardo channel {channel} is not digitised, used channels are: {self.__channels}')
+
+    # Digitised channel numbers, in the order of data columns
+    @property
+    def Channels(self):
+        return list(self.__channels)
+
+    @property
+    def SampleRate(self):
+        return self.__sample_rate
+
+    # Reads one data block into a given array (or into an internal buffer if out is None)
+    # and returns it as a (samples, channels) array
+    def _read_block(self, out=None):
+        if self.__ring is not None:
+            return self._next_streamed_block(out)
+
+        if out is None:
+            ptr, data = self.__buffer_ptr, self.__data
         else:
+            self._check_out(out)
+            ptr, data = out.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), out.reshape(-1, self.__N_CHANNELS)
+
+        t_start = time.perf_counter()
+        ret = self.PerformRead(self.hDevice, ptr, self.__points)
+        self._update_latency(time.perf_counter() - t_start)
+        if ret != 0:
             raise LeonardoReadException(ret)
+        return data
 
-    def MeasureMany(self):
-        nSamples = self.__points
-        buff = (ctypes.c_double * (self.__N_CHANNELS * nSamples))()
-        ret = self.PerformRead(self.hDevice, buff, nSamples)
-        if ret == 0:
-            data_read = np.array(buff).reshape(-1, self.__N_CHANNELS)
-            return data_read
+    # Digital processing pipeline.
+    # Stages (see LeonardoFilters) are applied to every block before averaging by MeasureNow, MeasureAll,
+    # MeasureStats and MeasureStatsAdaptive. MeasureMany and GetSamples always return raw data.
+    def AddFilter(self, stage):
+        self.__filters.append(stage)
+
+    def ClearFilters(self):
+        self.__filters = []
+
+    @property
+    def Filters(self):
+        return list(self.__filters)
+
+    # Reads one data block and applies all processing stages to it
+    def _read_processed(self):
+        data = self._read_block()
+        for stage in self.__filters:
+            data = stage.apply(data, self.__sample_rate, self.__columns)
+        return data
+
+    def _update_latency(self, latency):
+        self.__last_latency = latency
+        self.__total_latency += latency
+        self.__n_reads += 1
+
+    # Time to acquire one block at a board sample rate, seconds
+    @property
+    def BlockDuration(self):
+        return self.__points / self.__sample_rate
+
+    # Actual time spent for the last block read, seconds
+    @property
+    def LastReadLatency(self):
+        return self.__last_latency
+
+    # Average time spent for one block read since driver creation, seconds
+    @property
+    def MeanReadLatency(self):
+        return self.__total_latency / self.__n_reads if self.__n_reads else 0
+
+    # Streaming mode.
+    # A background thread reads blocks continuously into a ring buffer, so there are no gaps between blocks.
+    # Only this thread writes, and it publishes a block by increasing the written samples counter
+    # after the block is complete, so readers need no locks. Each sample is identified by its index
+    # since streaming start, and its time is stream start time + index / sample rate.
+    def StartStreaming(self, buffer_seconds=10):
+        if self.__ring is not None:
+            return
+        block = self.__points
+        n_blocks = max(2, int(np.ceil(buffer_seconds * self.__sample_rate / block)))
+        self.__ring = _aligned_empty(n_blocks * block * self.__N_CHANNELS).reshape(-1, self.__N_CHANNELS)
+        self.__written = 0
+        self.__stream_error = None
+        self.__stream_stop.clear()
+        self.__stream_t0 = time.time()
+        self.__stream_thread = threading.Thread(target=self.__StreamingThreadProc, daemon=True)
+        self.__stream_thread.start()
+        if self.__verbose:
+            print(f'Leonardo streaming started, ring buffer is {n_blocks * block / self.__sample_rate:.1f} sec')
+
+    def StopStreaming(self):
+        if self.__ring is None:
+            return
+        self.__stream_stop.set()
+        self.__stream_thread.join()
+        self.__stream_thread = None
+        self.__ring = None
+
+    def __StreamingThreadProc(self):
+        ring = self.__ring
+        block = self.__points
+        capacity = ring.shape[0]
+        f_first = True
+        while not self.__stream_stop.is_set():
+            pos = self.__written % capacity
+            ptr = ring[pos: pos + block].ctypes.data_as(ctypes.POINTER(ctypes.c_double))
+            ret = self.PerformRead(self.hDevice, ptr, block)
+            if ret != 0:
+                self.__stream_error = LeonardoReadException(ret)
+                break
+            if f_first:  # the first block was acquired just before it was returned
+                self.__stream_t0 = time.time() - block / self.__sample_rate
+                f_first = False
+            self.__written += block  # publish the block
+
+    @property
+    def IsStreaming(self):
+        return self.__ring is not None
+
+    # Index of the next sample to be written (number of samples acquired since streaming start)
+    @property
+    def SamplesWritten(self):
+        return self.__written
+
+    # time.time() of a sample with a given index
+    def SampleTime(self, index):
+        return self.__stream_t0 + np.asarray(index) / self.__sample_rate
+
+    # Index of a sample acquired at a given time.time()
+    def SampleIndex(self, t):
+        return int((t - self.__stream_t0) * self.__sample_rate)
+
+    # Copies samples [start, stop) from a ring buffer.
+    # Returns a tuple (times, data), data is a (samples, channels) array.
+    def GetSamples(self, start, stop):
+        if self.__ring is None:
+            raise LeonardoStreamException('Streaming is not started')
+        if self.__stream_error is not None:
+            raise self.__stream_error
+        capacity = self.__ring.shape[0]
+        stop = min(stop, self.__written)
+        start = max(start, 0)
+        if stop <= start:
+            return np.empty(0), np.empty((0, self.__N_CHANNELS))
+
+        idx = np.arange(start, stop)
+        data = self.__ring[idx % capacity]  # fancy indexing makes a copy
+
+        # a writer may overwrite the oldest block while we were copying
+        if start < self.__written + self.__points - capacity:
+            raise LeonardoStreamException('Requested samples were already overwritten, increase a buffer size')
+        return self.SampleTime(idx), data
+
+    # Returns samples acquired in a time range (time.time() values)
+    def GetWindow(self, t_from, t_to):
+        return self.GetSamples(self.SampleIndex(t_from), self.SampleIndex(t_to))
+
+    # Streaming mode: waits until samples up to t_to (time.time()) are acquired
+    # and returns a tuple (mean, standard error) of a channel in a time range [t_from, t_to)
+    def MeasureWindow(self, channel, t_from, t_to):
+        if self.__ring is None:
+            raise LeonardoStreamException('Streaming is not started')
+        column = self.ChannelColumn(channel)
+        stop = self.SampleIndex(t_to)
+        while self.__written < stop:
+            if self.__stream_error is not None:
+                raise self.__stream_error
+            time.sleep(max(t_to - time.time(), self.BlockDuration / 4))
+        _, data = self.GetWindow(t_from, t_to)
+        values = data[:, column]
+        if len(values) < 2:
+            return values.mean() if len(values) else np.nan, np.nan
+        return values.mean(), values.std(ddof=1) / np.sqrt(len(values))
+
+    # Waits for the next complete block in streaming mode and copies it to out or to an internal buffer
+    def _next_streamed_block(self, out):
+        t_start = time.perf_counter()
+        start = self.__written
+        while self.__written < start + self.__points:
+            if self.__stream_error is not None:
+                raise self.__stream_error
+            time.sleep(self.BlockDuration / 4)
+        _, data = self.GetSamples(start, start + self.__points)
+        self._update_latency(time.perf_counter() - t_start)
+
+        if out is None:
+            dest = self.__data
         else:
-            raise LeonardoReadException(ret)
+            self._check_out(out)
+            dest = out.reshape(-1, self.__N_CHANNELS)
+        dest[:] = data
+        return dest
+
+    def MeasureNow(self, channel):
+        column = self.ChannelColumn(channel)
+        data_read = self._read_processed()
+        return data_read[:, column].mean()  # average only a requested channel
+
+    # Places values of digitised channels into an array indexed by a channel number, NaN for unused channels
+    def _by_channel(self, values):
+        res = np.full(LEONARDO_MAX_CHANNELS, np.nan)
+        res[self.__channels] = values
+        return res
+
+    # Returns mean values of all channels obtained from one data block, indexed by a channel number.
+    # If with_std is True, returns a tuple (means, standard deviations).
+    def MeasureAll(self, with_std=False):
+        data_read = self._read_processed()
+        means = self._by_channel(data_read.mean(axis=0))
+        if with_std:
+            return means, self._by_channel(data_read.std(axis=0))
+        return means
+
+    # Returns LeonardoStats of all channels obtained from one data block
+    def MeasureStats(self):
+        stats = BlockStats(self._read_processed())
+        self.__last_samples_used = stats.n
+        return LeonardoStats(self._by_channel(stats.mean), self._by_channel(stats.sem),
+                             self._by_channel(stats.min), self._by_channel(stats.max), stats.n)
+
+    # Adaptive averaging.
+    # Reads data blocks until a standard error of the mean of a given channel becomes less than target_sem (volts),
+    # or max_samples samples are read. Returns LeonardoStats of all channels for all read samples.
+    def MeasureStatsAdaptive(self, channel, target_sem, max_samples):
+        column = self.ChannelColumn(channel)
+        part = None
+        while True:
+            data = self._read_processed()
+            block = (data.shape[0], data.mean(axis=0), ((data - data.mean(axis=0)) ** 2).sum(axis=0),
+                     data.min(axis=0), data.max(axis=0))
+            part = block if part is None else _combine_parts(part, block)
+
+            n, mean, m2, d_min, d_max = part
+            sem = np.sqrt(m2 / (n - 1) / n) if n > 1 else np.full(len(mean), np.inf)
+            if sem[column] <= target_sem or n + self.__points > max_samples:
+                break
+
+        self.__last_samples_used = n
+        return LeonardoStats(self._by_channel(mean), self._by_channel(sem), self._by_channel(d_min),
+                             self._by_channel(d_max), n)
+
+    # Number of samples averaged in the last measured point (by MeasureStats or MeasureStatsAdaptive)
+    @property
+    def LastSamplesUsed(self):
+        return self.__last_samples_used
+
+    # Returns a (samples, channels) array of raw data, only digitised channels are present (see ChannelColumn).
+    # If out is None, a view of an internal buffer is returned, it is valid only until the next read;
+    # copy it, or pass a preallocated array as out, to keep the data.
+    def MeasureMany(self, out=None):
+        return self._read_block(out)
 
     def __del__(self):
-        self.FreeBoard(self.hDevice)
+        # __init__ may fail before streaming attributes or a board handle are set, e.g. if a board is not found
+        if getattr(self, '_Leonardo__ring', None) is not None:
+            self.StopStreaming()
+        if hasattr(self, 'hDevice'):
+            self.FreeBoard(self.hDevice)
 
 
 class DebugLeonardo:
-    def __init__(self, channels=8, n_samples=500, verbose=True):
-        self.__channels = channels
+    def __init__(self, channels=8, n_samples=500, verbose=True, sample_rate=LEONARDO_SAMPLE_FREQ):
+        self.__channels = len(_channels_list(channels))
         self.__n_samples = n_samples
         print('Leonardo DEBUG mode, no real measurement will be done')
 
     def MeasureNow(self, channel):
         return (np.random.rand(1)[0]) * 100
 
-    def MeasureMany(self):
-        return np.random.rand(self.__n_samples, self.__channels)
+    def MeasureAll(self, with_std=False):
+        means = np.random.rand(LEONARDO_MAX_CHANNELS) * 100
+        if with_std:
+            return means, np.random.rand(LEONARDO_MAX_CHANNELS)
+        return means
+
+    def MeasureStats(self):
+        data = np.random.rand(self.__n_samples, LEONARDO_MAX_CHANNELS) * 100
+        return BlockStats(data)
+
+    def MeasureStatsAdaptive(self, channel, target_sem, max_samples):
+        return self.MeasureStats()
+
+    @property
+    def LastSamplesUsed(self):
+        return self.__n_samples
+
+    def MeasureMany(self, out=None):
+        if out is None:
+            return np.random.rand(self.__n_samples, self.__channels)
+        out.reshape(-1, self.__channels)[:] = np.random.rand(self.__n_samples, self.__channels)
+        return out.reshape(-1, self.__channels)
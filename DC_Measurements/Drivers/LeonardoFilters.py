@@ -0,0 +1,113 @@
+# Digital processing stages for Leonardo data blocks.
+# A stage takes a (samples, channels) block and returns a processed block, all channels are processed at once.
+# Stages are added to a driver by Leonardo.AddFilter() and are applied in the order of addition
+# to every block before it is averaged.
+import numpy as np
+from scipy import signal
+
+
+class BlockFilter:
+    # data - (samples, channels) array, must not be modified in place
+    # sample_rate - samples per second for each channel
+    # columns - a dictionary {channel number: data column}
+    def apply(self, data, sample_rate, columns):
+        # must be overridden in a child class
+        return data
+
+
+# Keeps an integer number of mains periods in a block (drops the tail),
+# so mains pickup is averaged out exactly
+class MainsCycleWindow(BlockFilter):
+    def __init__(self, mains_freq=50):
+        self.mains_freq = mains_freq
+        self.__warned = False
+
+    def apply(self, data, sample_rate, columns):
+        period = sample_rate / self.mains_freq  # samples in one mains period
+        n_periods = int(data.shape[0] // period)
+        if n_periods == 0:
+            if not self.__warned:
+                print(f'Warning! A block is shorter than one mains period ({int(np.ceil(period))} samples), '
+                      'mains window is not applied.')
+                self.__warned = True
+            return data
+        return data[:int(round(n_periods * period))]
+
+
+# A block size (samples) rounded up to a whole number of mains periods, at least one period,
+# so MainsCycleWindow keeps all of it
+def MainsBlockSize(n_samples, sample_rate, mains_freq=50):
+    period = sample_rate / mains_freq
+    n_periods = max(int(np.ceil(n_samples / period)), 1)
+    return int(np.ceil(n_periods * period))
+
+
+# Filters of a single block can not act on frequencies whose period is longer than the block
+def _check_block_length(data, sample_rate, freq, name):
+    min_samples = MainsBlockSize(1, sample_rate, freq)  # samples in one period
+    if data.shape[0] < min_samples:
+        raise ValueError(f'{name} requires a block of at least one {freq} Hz period ({min_samples} samples), '
+                         f'a block has {data.shape[0]} samples. Increase a number of samples in a point.')
+
+
+# Removes a frequency and (optionally) its harmonics by zero-phase IIR notch filters.
+# Each block is filtered separately, so a block must contain at least one period of the frequency
+# (see MainsBlockSize), and filter transients make longer blocks better.
+class NotchFilter(BlockFilter):
+    def __init__(self, freq=50, quality=30, harmonics=1):
+        self.freq = freq
+        self.quality = quality
+        self.harmonics = harmonics
+        self.__coeffs = None
+        self.__coeffs_rate = None
+
+    def __get_coeffs(self, sample_rate):
+        if self.__coeffs_rate != sample_rate:
+            self.__coeffs = [signal.iirnotch(self.freq * k, self.quality, fs=sample_rate)
+                             for k in range(1, self.harmonics + 1) if self.freq * k < sample_rate / 2]
+            self.__coeffs_rate = sample_rate
+        return self.__coeffs
+
+    def apply(self, data, sample_rate, columns):
+        _check_block_length(data, sample_rate, self.freq, 'Notch filter')
+        for b, a in self.__get_coeffs(sample_rate):
+            data = signal.filtfilt(b, a, data, axis=0)
+        return data
+
+
+# Software lock-in amplifier.
+# Multiplies signal channels by a reference channel (normalized to unit amplitude and shifted by phase),
+# so an average of a processed channel is an amplitude of a signal component in phase with the reference.
+# Other components (e.g. mains pickup) are suppressed only by averaging over a block, so a block must be
+# at least one mains period long, and they cancel exactly only for whole periods of both the reference
+# and the mains (see MainsBlockSize).
+# channels - channels to demodulate, all except the reference if None
+# phase - reference phase shift, degrees
+class LockInDemodulator(BlockFilter):
+    def __init__(self, reference_channel, channels=None, phase=0, mains_freq=50):
+        self.reference_channel = reference_channel
+        self.channels = channels
+        self.phase = phase
+        self.mains_freq = mains_freq
+
+    def apply(self, data, sample_rate, columns):
+        _check_block_length(data, sample_rate, self.mains_freq, 'Lock-in demodulator')
+        ref_col = columns[self.reference_channel]
+        ref = data[:, ref_col] - data[:, ref_col].mean()
+        if self.phase != 0:
+            ref_q = np.imag(signal.hilbert(ref))  # reference shifted by 90 degrees
+            phi = np.deg2rad(self.phase)
+            ref = ref * np.cos(phi) + ref_q * np.sin(phi)
+        rms = np.sqrt(np.mean(ref ** 2))
+        if rms == 0:
+            raise ValueError('Lock-in reference channel has no AC signal')
+        ref_unit = ref * (np.sqrt(2) / rms)  # a sine with amplitude 1 -> averages give a peak amplitude
+
+        if self.channels is None:
+            signal_cols = [col for ch, col in columns.items() if ch != self.reference_channel]
+        else:
+            signal_cols = [columns[ch] for ch in self.channels]
+
+        res = data.copy()
+        res[:, signal_cols] = data[:, signal_cols] * ref_unit[:, np.newaxis]
+        return res
@@ -0,0 +1,124 @@
+# Physical models of samples for simulated measurements (see InstrumentSimulator).
+# A model gives a sample voltage for a current through it, using a state of simulated devices:
+# a temperature, a magnetic field, a gate voltage and a microwave generator.
+# All functions are vectorised: a whole block of Leonardo samples or a hardware sweep is computed at once.
+#
+# Usage: EnableSimulation(sample=JosephsonJunction(Ic=2e-6, Rn=50)), or world.sample = JosephsonJunction(...)
+import numpy as np
+from scipy.special import jv
+
+K_BOLTZMANN = 1.380649e-23  # J/K
+H_PLANCK = 6.62607015e-34  # J*s
+E_CHARGE = 1.602176634e-19  # C
+BCS_GAP_RATIO = 1.764  # gap at zero temperature / (k*Tc)
+MAX_SHAPIRO_STEP = 200
+
+
+# BCS superconducting gap (an interpolation formula), joules
+def BCSGap(T, Tc):
+    T = np.maximum(np.asarray(T, dtype=float), 1e-6)
+    gap0 = BCS_GAP_RATIO * K_BOLTZMANN * Tc
+    return gap0 * np.tanh(1.74 * np.sqrt(np.maximum(Tc / T - 1, 0)))
+
+
+# Ambegaokar-Baratoff law: a critical current at a temperature relative to zero temperature one
+def AmbegaokarBaratoff(T, Tc):
+    T = np.maximum(np.asarray(T, dtype=float), 1e-6)
+    gap = BCSGap(T, Tc)
+    return gap / (BCS_GAP_RATIO * K_BOLTZMANN * Tc) * np.tanh(gap / (2 * K_BOLTZMANN * T))
+
+
+# A Josephson junction (or a weak link) in the RSJ model.
+# Rn - normal resistance, ohms; Ic - critical current at zero temperature, field and gate voltage, amperes;
+# Tc - critical temperature, K, with a transition width (a residual resistance near Tc);
+# retrapping - retrapping to critical current ratio: < 1 gives a hysteretic I-V curve, 1 - an overdamped junction;
+# switching_spread - a relative rms spread of switching currents (for switching statistics);
+# field_period - a field of one flux quantum in a junction (Fraunhofer pattern), G;
+# gate_cutoff - a gate voltage which fully suppresses a critical current, V (None - no gate effect);
+# rf_coupling - a microwave amplitude at a junction per a generator amplitude (into 50 ohms);
+# noise - voltage noise, V rms; mains_pickup - a 50 Hz pickup amplitude, V.
+class JosephsonJunction:
+    def __init__(self, Rn=100., Ic=1e-6, Tc=1.2, transition_width=0.02, retrapping=0.3, switching_spread=0.01,
+                 field_period=10., gate_cutoff=20., rf_coupling=1e-3, noise=1e-7, mains_pickup=0.,
+                 mains_frequency=50.):
+        self.Rn = Rn
+        self.Ic = Ic
+        self.Tc = Tc
+        self.transition_width = transition_width
+        self.retrapping = retrapping
+        self.switching_spread = switching_spread
+        self.field_period = field_period
+        self.gate_cutoff = gate_cutoff
+        self.rf_coupling = rf_coupling
+        self.noise = noise
+        self.mains_pickup = mains_pickup
+        self.mains_frequency = mains_frequency
+        self.rng = np.random.default_rng()
+        self._switched = False  # a junction state after the last computed point
+
+    # Critical current for a temperature (K), a field (G) and a gate voltage (V), all may be arrays
+    def CriticalCurrent(self, T, B=0., Vg=0.):
+        ic = self.Ic * AmbegaokarBaratoff(T, self.Tc) * np.abs(np.sinc(np.asarray(B) / self.field_period))
+        if self.gate_cutoff is not None:
+            ic = ic * np.clip(1 - (np.asarray(Vg) / self.gate_cutoff) ** 2, 0, 1)
+        return ic
+
+    # A resistance of a superconducting state: zero far below Tc, Rn above it
+    def ResidualResistance(self, T):
+        x = np.clip((self.Tc - np.asarray(T, dtype=float)) / self.transition_width, -50, 50)
+        return self.Rn / (1 + np.exp(x))
+
+    # Microwave amplitude at a junction in units of hf/2e
+    def RFAmplitude(self, world):
+        if not world.rf_on:
+            return 0.
+        v_rf = self.rf_coupling * np.sqrt(2 * 50 * 1e-3 * 10 ** (world.rf_power / 10))
+        return 2 * E_CHARGE * v_rf / (H_PLANCK * world.rf_frequency)
+
+    # A junction state (switched to a resistive one or not) at each point of a current sequence.
+    # It switches above a critical current and retraps below a retrapping current, otherwise it keeps a state,
+    # so events are forward-filled from the previous point.
+    def _states(self, current, ic):
+        abs_i = np.abs(current)
+        ic_switch = ic * (1 + self.switching_spread * self.rng.standard_normal(current.shape))
+        events = np.full(current.shape, -1, dtype=np.int8)
+        events[abs_i > ic_switch] = 1
+        events[abs_i < ic * self.retrapping] = 0
+        events = np.concatenate(([np.int8(self._switched)], events))
+        idx = np.where(events >= 0, np.arange(len(events)), 0)
+        states = events[np.maximum.accumulate(idx)][1:].astype(bool)
+        self._switched = bool(states[-1])
+        return states
+
+    # current - amperes (a scalar or an array of sequential points), t - time.time() values
+    def Voltage(self, current, t, world):
+        current = np.asarray(current, dtype=float)
+        shape = current.shape
+        current = current.ravel()
+        if current.size == 0:
+            return current.reshape(shape)
+        t = np.broadcast_to(np.asarray(t, dtype=float), shape).ravel()
+        T = world.Temperature()
+        ic = self.CriticalCurrent(T, world.Field(t), world.GateVoltage(t))
+
+        a = self.RFAmplitude(world)
+        ic_dc = ic * np.abs(jv(0, a)) if a > 0 else ic  # microwaves suppress a zero voltage step
+
+        # a retrapping current is only a threshold of switching back (see _states),
+        # a resistive branch is V = Rn * sqrt(I^2 - Ic^2) of the RSJ model
+        v = self.ResidualResistance(T) * current
+        states = self._states(current, ic_dc)
+        i_res = current[states]
+        v[states] = self.Rn * np.sign(i_res) * np.sqrt(np.maximum(i_res ** 2 - ic_dc[states] ** 2, 0))
+
+        if a > 0:  # Shapiro steps: voltage is locked to n*hf/2e in current ranges of widths 2*Ic*|Jn(a)|
+            v_step = H_PLANCK * world.rf_frequency / (2 * E_CHARGE)
+            n = np.clip(np.rint(v / v_step), -MAX_SHAPIRO_STEP, MAX_SHAPIRO_STEP)
+            locked = states & (n != 0) & (np.abs(current - n * v_step / self.Rn) < ic * np.abs(jv(n, a)))
+            v[locked] = n[locked] * v_step
+
+        if self.noise:
+            v += self.noise * self.rng.standard_normal(v.shape)
+        if self.mains_pickup:
+            v += self.mains_pickup * np.sin(2 * np.pi * self.mains_frequency * t)
+        return v.reshape(shape)
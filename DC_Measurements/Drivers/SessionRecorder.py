@@ -0,0 +1,436 @@
+# Recording and replay of instrument sessions.
+# A recording wraps a VISA resource manager and a Leonardo library (see visa_device.UseResourceManager and
+# Leonardo.UseLibrary) and logs every bus operation (a command, a response or an error, a timestamp and a duration)
+# and every raw Leonardo data block into a compact binary file.
+# A replay serves logged responses back to drivers, with original durations or without waiting,
+# so a whole measurement script can be re-executed offline with real data, e.g. for profiling and timing.
+#
+# Usage: StartRecording(filename) or StartReplay(filename, realtime) before creating drivers,
+# or "-record <file>", "-replay <file>" (and "-replay_fast") command line arguments of measurement scripts.
+#
+# File format: a header (magic, recording start time), then records:
+# kind (byte), session (uint16), time since start, duration (doubles), text and data lengths (uint32), text, data.
+# Text is a command or an address, data is a response (UTF-8), values (float64) or an error code.
+import atexit
+import ctypes
+import struct
+import threading
+import time
+from collections import defaultdict, deque
+import numpy as np
+
+from Drivers import visa_device
+from Drivers import Leonardo
+
+SESSION_MAGIC = b'LMSESS1\0'
+_HEADER = struct.Struct('<8sd')
+_RECORD = struct.Struct('<BHddII')
+_ERROR = struct.Struct('<Bi')  # a kind of a failed operation, VISA error code
+_LEONARDO_INIT = struct.Struct('<IdIIi')  # samples in a block, sample rate, channel mask, return code, handle
+_LEONARDO_READ = struct.Struct('<I')  # return code, followed by a data block
+
+LEONARDO_ADDRESS = 'LEONARDO'
+
+# record kinds
+REC_OPEN = 1  # text - an address, data - driver class names separated by newlines
+REC_WRITE = 2
+REC_READ = 3
+REC_QUERY = 4
+REC_ASCII_VALUES = 5
+REC_BINARY_VALUES = 6
+REC_CLEAR = 7
+REC_ERROR = 8  # an operation raised a VISA error
+REC_LEONARDO_INIT = 9
+REC_LEONARDO_READ = 10
+
+
+class SessionRecord:
+    __slots__ = ('kind', 'session', 't', 'duration', 'text', 'data')
+
+    def __init__(self, kind, session, t, duration, text, data):
+        self.kind = kind
+        self.session = session
+        self.t = t
+        self.duration = duration
+        self.text = text
+        self.data = data
+
+
+# Appends records to a session file, may be used from several threads
+class SessionWriter:
+    def __init__(self, filename):
+        self.filename = filename
+        self.__file = open(filename, 'wb')
+        self.__lock = threading.Lock()
+        self.__t0 = time.time()
+        self.__n_sessions = 0
+        self.__file.write(_HEADER.pack(SESSION_MAGIC, self.__t0))
+
+    def NewSession(self, address, driver_names=()):
+        with self.__lock:
+            self.__n_sessions += 1
+            session = self.__n_sessions
+        self.Add(REC_OPEN, session, time.time(), 0., address, '\n'.join(driver_names).encode())
+        return session
+
+    # t - time.time() of an operation start, duration - seconds
+    def Add(self, kind, session, t, duration, text, data=b''):
+        text = text.encode()
+        with self.__lock:
+            if self.__file is None:
+                return
+            self.__file.write(_RECORD.pack(kind, session, t - self.__t0, duration, len(text), len(data)))
+            self.__file.write(text)
+            self.__file.write(data)
+
+    def Close(self):
+        with self.__lock:
+            if self.__file is not None:
+                self.__file.close()
+                self.__file = None
+
+
+# Reads all records of a session file
+def ReadSession(filename):
+    with open(filename, 'rb') as f:
+        buf = f.read()
+    magic, t0 = _HEADER.unpack_from(buf, 0)
+    if magic != SESSION_MAGIC:
+        raise ValueError(f'{filename} is not a recorded session file')
+    records = []
+    pos = _HEADER.size
+    while pos + _RECORD.size <= len(buf):
+        kind, session, t, duration, n_text, n_data = _RECORD.unpack_from(buf, pos)
+        pos += _RECORD.size
+        text = buf[pos: pos + n_text].decode()
+        pos += n_text
+        records.append(SessionRecord(kind, session, t, duration, text, buf[pos: pos + n_data]))
+        pos += n_data
+    return records
+
+
+def _values_to_bytes(values):
+    return np.asarray(values, dtype=np.float64).tobytes()
+
+
+# A VISA session which logs all operations of an underlying session
+class RecordingResource:
+    def __init__(self, writer, session, resource):
+        self.__writer = writer
+        self.__session = session
+        self.__resource = resource
+
+    @property
+    def timeout(self):
+        return self.__resource.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self.__resource.timeout = value
+
+    def __call(self, kind, cmd_str, operation, encode):
+        t = time.time()
+        t_start = time.perf_counter()
+        try:
+            result = operation()
+        except visa_device.VisaIOError as e:
+            self.__writer.Add(REC_ERROR, self.__session, t, time.perf_counter() - t_start, cmd_str,
+                              _ERROR.pack(kind, e.error_code))
+            raise
+        self.__writer.Add(kind, self.__session, t, time.perf_counter() - t_start, cmd_str, encode(result))
+        return result
+
+    def write(self, message):
+        return self.__call(REC_WRITE, message, lambda: self.__resource.write(message), lambda r: b'')
+
+    def read(self):
+        return self.__call(REC_READ, '', self.__resource.read, lambda r: r.encode())
+
+    def query(self, message):
+        return self.__call(REC_QUERY, message, lambda: self.__resource.query(message), lambda r: r.encode())
+
+    def query_ascii_values(self, message, **kwargs):
+        return self.__call(REC_ASCII_VALUES, message, lambda: self.__resource.query_ascii_values(message, **kwargs),
+                           _values_to_bytes)
+
+    def query_binary_values(self, message, **kwargs):
+        return self.__call(REC_BINARY_VALUES, message, lambda: self.__resource.query_binary_values(message, **kwargs),
+                           _values_to_bytes)
+
+    def clear(self):
+        return self.__call(REC_CLEAR, '', self.__resource.clear, lambda r: b'')
+
+    def close(self):
+        self.__resource.close()
+
+
+class RecordingResourceManager:
+    wants_driver_names = True
+
+    def __init__(self, writer, resource_manager):
+        self.__writer = writer
+        self.__rm = resource_manager
+
+    def open_resource(self, address, driver_names=()):
+        if getattr(self.__rm, 'wants_driver_names', False):
+            resource = self.__rm.open_resource(address, driver_names=driver_names)
+        else:
+            resource = self.__rm.open_resource(address)
+        return RecordingResource(self.__writer, self.__writer.NewSession(address, driver_names), resource)
+
+    def close(self):
+        self.__rm.close()
+
+
+# A function of a DLL stand-in: accepts ctypes argtypes and restype like a real one
+# and passes them to a wrapped DLL function, if any
+class _LibraryFunction:
+    def __init__(self, call, inner=None):
+        self.__call = call
+        self.__inner = inner
+        self.__argtypes = None
+        self.__restype = None
+
+    @property
+    def argtypes(self):
+        return self.__argtypes
+
+    @argtypes.setter
+    def argtypes(self, value):
+        self.__argtypes = value
+        if self.__inner is not None:
+            self.__inner.argtypes = value
+
+    @property
+    def restype(self):
+        return self.__restype
+
+    @restype.setter
+    def restype(self, value):
+        self.__restype = value
+        if self.__inner is not None:
+            self.__inner.restype = value
+
+    def __call__(self, *args):
+        return self.__call(*args)
+
+
+# A Leonardo library which logs initialisation and all data blocks of a wrapped library.
+# Leonardo_wrapper.dll is loaded only when a Leonardo is created.
+class RecordingLeonardoLibrary:
+    def __init__(self, writer, library=None):
+        self.__writer = writer
+        self.__library = library
+        self.__boards = {}  # handle -> (session, number of channels)
+
+    def __getattr__(self, name):
+        if name not in ('InitBoard', 'InitBoardEx', 'PerformRead', 'FreeBoard'):
+            raise AttributeError(name)
+        if self.__library is None:
+            self.__library = ctypes.WinDLL('Leonardo_wrapper.dll')
+        inner = getattr(self.__library, name)  # AttributeError for an old DLL without InitBoardEx
+        if name == 'InitBoard':
+            func = _LibraryFunction(lambda handle, n: self.__init_board(
+                inner, handle, n, Leonardo.LEONARDO_SAMPLE_FREQ, (1 << Leonardo.LEONARDO_MAX_CHANNELS) - 1), inner)
+        elif name == 'InitBoardEx':
+            func = _LibraryFunction(lambda handle, n, rate, mask: self.__init_board(inner, handle, n, rate, mask, True),
+                                    inner)
+        elif name == 'PerformRead':
+            func = _LibraryFunction(lambda handle, ptr, n: self.__read(inner, handle, ptr, n), inner)
+        else:
+            func = inner
+        setattr(self, name, func)
+        return func
+
+    def __init_board(self, inner, handle, n_samples, rate, mask, extended=False):
+        t = time.time()
+        t_start = time.perf_counter()
+        ret = inner(handle, n_samples, rate, mask) if extended else inner(handle, n_samples)
+        session = self.__writer.NewSession(LEONARDO_ADDRESS)
+        self.__writer.Add(REC_LEONARDO_INIT, session, t, time.perf_counter() - t_start, '',
+                          _LEONARDO_INIT.pack(n_samples, rate, mask, ret, handle.value))
+        self.__boards[handle.value] = (session, bin(mask).count('1'))
+        return ret
+
+    def __read(self, inner, handle, ptr, n_samples):
+        t = time.time()
+        t_start = time.perf_counter()
+        ret = inner(handle, ptr, n_samples)
+        duration = time.perf_counter() - t_start
+        session, n_channels = self.__boards.get(handle, (0, Leonardo.LEONARDO_MAX_CHANNELS))
+        block = np.ctypeslib.as_array(ptr, shape=(n_samples * n_channels,)) if ret == 0 else np.empty(0)
+        self.__writer.Add(REC_LEONARDO_READ, session, t, duration, '', _LEONARDO_READ.pack(ret) + block.tobytes())
+        return ret
+
+
+# Records of one recorded session, served in order
+class _ReplaySession:
+    def __init__(self, address, records, realtime):
+        self.address = address
+        self.__records = deque(records)
+        self.__realtime = realtime
+        self.__lock = threading.Lock()
+        self.__diverged = False
+
+    # Returns the next record of a given operation. If a script skips some recorded operations,
+    # they are skipped up to a matching record. An operation which was not recorded does not change
+    # a replay position, a device does not respond to it (a timeout).
+    def Next(self, kind, cmd_str=''):
+        with self.__lock:
+            match = None
+            for i, rec in enumerate(self.__records):
+                error_kind = _ERROR.unpack(rec.data)[0] if rec.kind == REC_ERROR else None
+                if kind in (rec.kind, error_kind) and rec.text == cmd_str:
+                    match = i
+                    break
+            if match != 0 and not self.__diverged:
+                self.__diverged = True
+                print(f'Warning! Replay of {self.address} differs from a recording at "{cmd_str}"')
+            if match is None:
+                raise visa_device.VisaIOError(visa_device.VI_ERROR_TMO)
+            for _ in range(match + 1):
+                rec = self.__records.popleft()
+        if self.__realtime and rec.duration > 0:
+            time.sleep(rec.duration)
+        if rec.kind == REC_ERROR:
+            raise visa_device.VisaIOError(_ERROR.unpack(rec.data)[1])
+        return rec
+
+
+class ReplayResource:
+    def __init__(self, session):
+        self.__session = session
+        self.timeout = 2000
+
+    def write(self, message):
+        self.__session.Next(REC_WRITE, message)
+
+    def read(self):
+        return self.__session.Next(REC_READ).data.decode()
+
+    def query(self, message):
+        return self.__session.Next(REC_QUERY, message).data.decode()
+
+    def query_ascii_values(self, message, container=list, **kwargs):
+        return container(np.frombuffer(self.__session.Next(REC_ASCII_VALUES, message).data).tolist())
+
+    def query_binary_values(self, message, container=list, **kwargs):
+        return container(np.frombuffer(self.__session.Next(REC_BINARY_VALUES, message).data).tolist())
+
+    def clear(self):
+        self.__session.Next(REC_CLEAR)
+
+    def close(self):
+        pass
+
+
+# Serves recorded sessions: sessions of one address are used in the order they were opened in a recording
+class _ReplaySessions:
+    def __init__(self, filename, realtime):
+        records = ReadSession(filename)
+        addresses = {r.session: r.text for r in records if r.kind == REC_OPEN}
+        by_session = defaultdict(list)
+        for r in records:
+            if r.kind != REC_OPEN:
+                by_session[r.session].append(r)
+        self.__free = defaultdict(deque)  # address -> sessions not used yet
+        for session, address in sorted(addresses.items()):
+            self.__free[address].append(_ReplaySession(address, by_session[session], realtime))
+        self.__lock = threading.Lock()
+
+    def Open(self, address):
+        with self.__lock:
+            sessions = self.__free.get(address)
+            if not sessions:
+                raise visa_device.VisaIOError(visa_device.VI_ERROR_TMO)  # a device was not used in a recording
+            return sessions.popleft()
+
+
+class ReplayResourceManager:
+    def __init__(self, sessions):
+        self.__sessions = sessions
+
+    def open_resource(self, address):
+        return ReplayResource(self.__sessions.Open(address))
+
+    def close(self):
+        pass
+
+
+# Error codes of a replayed Leonardo library
+REPLAY_ERROR_NOT_RECORDED = 0xFFFF0101  # Leonardo was not used in a recording
+REPLAY_ERROR_SETTINGS = 0xFFFF0102  # a block size, a sample rate or channels differ from a recording
+REPLAY_ERROR_NO_DATA = 0xFFFF0103  # a recording has no more data blocks
+
+
+# Leonardo_wrapper.dll stand-in which returns recorded data blocks
+class ReplayLeonardoLibrary:
+    def __init__(self, sessions):
+        self.__sessions = sessions
+        self.__boards = {}  # handle -> (replay session, samples in a block, number of channels)
+        all_channels = (1 << Leonardo.LEONARDO_MAX_CHANNELS) - 1
+        self.InitBoard = _LibraryFunction(
+            lambda handle, n: self.__init_board(handle, n, Leonardo.LEONARDO_SAMPLE_FREQ, all_channels))
+        self.InitBoardEx = _LibraryFunction(self.__init_board)
+        self.PerformRead = _LibraryFunction(self.__read)
+        self.FreeBoard = _LibraryFunction(lambda handle: 0)
+
+    # A script must use the same channels, block size and rate as a recorded one
+    def __init_board(self, handle, n_samples, rate, mask):
+        try:
+            session = self.__sessions.Open(LEONARDO_ADDRESS)
+            rec_samples, rec_rate, rec_mask, ret, value = _LEONARDO_INIT.unpack(session.Next(REC_LEONARDO_INIT).data)
+        except visa_device.VisaIOError:
+            return REPLAY_ERROR_NOT_RECORDED
+        if (rec_samples, rec_rate, rec_mask) != (n_samples, rate, mask):
+            print(f'Leonardo was recorded with {rec_samples} samples in a block, {rec_rate} Hz, '
+                  f'channel mask {rec_mask:#x}, replay requests {n_samples}, {rate} Hz, {mask:#x}')
+            return REPLAY_ERROR_SETTINGS
+        handle.value = value
+        self.__boards[value] = (session, n_samples, bin(mask).count('1'))
+        return ret
+
+    def __read(self, handle, ptr, n_samples):
+        try:
+            session, board_samples, n_channels = self.__boards[handle]
+            data = session.Next(REC_LEONARDO_READ).data
+        except (KeyError, visa_device.VisaIOError):
+            return REPLAY_ERROR_NO_DATA
+        ret = _LEONARDO_READ.unpack_from(data)[0]
+        if ret != 0:
+            return ret
+        block = np.frombuffer(data, dtype=np.float64, offset=_LEONARDO_READ.size)
+        if n_samples != board_samples or block.size != n_samples * n_channels:
+            return REPLAY_ERROR_SETTINGS
+        ctypes.memmove(ptr, block.ctypes.data, block.nbytes)
+        return ret
+
+
+_writer = None
+
+
+# Logs all instrument sessions opened later into a file, until a script exits
+def StartRecording(filename):
+    global _writer
+    if _writer is not None:
+        return _writer
+    _writer = SessionWriter(filename)
+    visa_device.UseResourceManager(RecordingResourceManager(_writer, visa_device._get_resource_manager()))
+    Leonardo.UseLibrary(RecordingLeonardoLibrary(_writer, Leonardo._library))
+    atexit.register(StopRecording)
+    print('Recording instrument sessions to', filename)
+    return _writer
+
+
+def StopRecording():
+    if _writer is not None:
+        _writer.Close()
+
+
+# Replays a recorded file instead of real devices.
+# realtime - each operation takes as much time as in a recording, otherwise responses are returned immediately.
+def StartReplay(filename, realtime=True):
+    sessions = _ReplaySessions(filename, realtime)
+    visa_device.UseResourceManager(ReplayResourceManager(sessions))
+    Leonardo.UseLibrary(ReplayLeonardoLibrary(sessions))
+    print('Replaying instrument sessions from', filename, '' if realtime else '(without delays)')
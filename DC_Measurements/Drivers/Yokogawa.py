@@ -1,7 +1,11 @@
 from Drivers import visa_device
+import time
 
 
 class YokogawaGS200(visa_device.visa_device):
+    program_max_steps = 10000
+    program_min_interval = 0.1  # seconds
+
     def __init__(self, device_num=4, dev_range='1E+0', what='VOLT', verbose=True):
         self.__verbose = verbose
 
@@ -19,20 +23,41 @@ class YokogawaGS200(visa_device.visa_device):
 
         super().__init__(device_num)
 
-        self.SendString('SYSTem:REMote')
-        self.SendString(f"SOUR:FUNC {what}")
-        self.SendString(f'SOUR:RANGe {dev_range}')
-        self.SendString('OUTPut ON')
+        self.SendMany(['SYSTem:REMote',
+                       f"SOUR:FUNC {what}",
+                       f'SOUR:RANGe {dev_range}',
+                       'OUTPut ON'])
 
         if self.__verbose:
             print('Yokogawa connection success')
 
     def SetOutput(self, value: float):
-        self.SendString(f":SOURce:LEVel {value}")
+        self.SendCached('level', f":SOURce:LEVel {value}")
 
     def GetOutput(self):
         return self.GetFloat('SOURce:LEVel?')
 
+    # Stores values as a program, which is stepped by a device timer every interval seconds,
+    # so step timing does not depend on a computer. A BNC output sends a trigger at each step.
+    def LoadProgram(self, values, interval):
+        if len(values) > self.program_max_steps:
+            raise ValueError(f'Yokogawa program can not have more than {self.program_max_steps} steps')
+        with self.Batch():
+            self.SendString('PROGram:REPeat OFF')
+            self.SendString(f'PROGram:INTerval {max(interval, self.program_min_interval)}')
+            self.SendString('PROGram:SLOPe 0')
+            self.SendString('ROUTe:BNCO TRIGger')
+            self.SendString('PROGram:EDIT:STARt')
+            for value in values:
+                self.SendString(f'SOURce:LEVel {value}')
+            self.SendString('PROGram:EDIT:END')
+
+    # Runs a loaded program, returns time.time() of its start (the first step)
+    def RunProgram(self):
+        self.InvalidateCached('level')
+        self.SendString('PROGram:RUN')
+        return time.time()
+
 
 class DebugYokogawaGS200:
     def __init__(self, device_num=4, dev_range='1E+0', what='VOLT', verbose=True):
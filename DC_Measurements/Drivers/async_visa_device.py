@@ -0,0 +1,69 @@
+# An asyncio interface to VISA devices.
+# VISA calls are blocking, so they are executed in a dedicated I/O thread pool,
+# and instruments on different GPIB addresses or interfaces can be accessed concurrently.
+# Calls to one device session are still executed one at a time (see the I/O lock in visa_device).
+#
+# Sample usage:
+# lakeshore = async_visa_device(iv_sweeper.lakeshore)
+# T, V = await GatherIO(lakeshore.Call('GetTemperature'), RunBlocking(iv_sweeper.MeasureNow, 6))
+# or from a usual (not asyncio) thread:
+# T, V = RunConcurrently(iv_sweeper.lakeshore.GetTemperature, lambda: iv_sweeper.MeasureNow(6))
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+IO_THREADS = 8  # maximal number of simultaneous instrument requests
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix='visa_io')
+        return _executor
+
+
+# Runs any blocking function in the I/O thread pool and awaits its result
+async def RunBlocking(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), functools.partial(func, *args, **kwargs))
+
+
+# Awaits several I/O operations together, returns their results in the same order
+async def GatherIO(*awaitables):
+    return await asyncio.gather(*awaitables)
+
+
+# Calls several blocking functions (without arguments) concurrently from a usual thread
+# and returns their results in the same order.
+# No event loop is created: other functions are run in the I/O thread pool, the first one in a calling thread.
+def RunConcurrently(*funcs):
+    futures = [_get_executor().submit(f) for f in funcs[1:]]
+    try:
+        first = funcs[0]()
+    finally:
+        wait(futures)
+    return [first] + [f.result() for f in futures]
+
+
+# Wraps a visa_device driver (or any other driver) and provides awaitable versions of its methods
+class async_visa_device:
+    def __init__(self, driver):
+        self.driver = driver
+
+    # Calls any driver method, e.g. await dev.Call('GetTemperature')
+    async def Call(self, method, *args, **kwargs):
+        return await RunBlocking(getattr(self.driver, method), *args, **kwargs)
+
+    async def SendString(self, cmd_str):
+        return await RunBlocking(self.driver.SendString, cmd_str)
+
+    async def GetString(self, cmd_str):
+        return await RunBlocking(self.driver.GetString, cmd_str)
+
+    async def GetFloat(self, cmd_str):
+        return await RunBlocking(self.driver.GetFloat, cmd_str)
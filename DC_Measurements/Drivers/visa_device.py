@@ -1,56 +1,477 @@
-# A base class for VISA devices manipulating.
-# Every driver is an ancestor if this class.
-# To work with devices you must install a PyVISA library
-# (pip install pyvisa)
-import visa
-import numpy as np
-
-
-class visa_device:
-    def __init__(self, device_id):
-        rm = visa.ResourceManager()
-        if isinstance(device_id, int):
-            device_num = int(device_id)
-            device = rm.open_resource(f"GPIB0::{device_num}::INSTR")
-        elif isinstance(device_id, str):
-            addr = str(device_id)
-            device = rm.open_resource(addr)
-        else:
-            raise ValueError('Invalid device initialization, please provide GPIB num or device address.')
-        self.device = device
-
-    def __error_message(self):
-        print('Check that device is connected, visible in NI MAX and is not used by another software.')
-
-    def SendString(self, cmd_str):
-        device = self.device
-        try:
-            device.write(cmd_str)
-        except visa.VisaIOError as e:
-            print('Unable to connect device.\n', e)
-            self.__error_message()
-
-    def GetString(self, cmd_str):
-        device = self.device
-        try:
-            resp = device.query(cmd_str)
-            return resp
-        except Exception as e:
-            print('Unable to connect device.\n', e)
-            self.__error_message()
-            return ""
-
-    def GetFloat(self, cmd_str):
-        device = self.device
-        resp = ""
-
-        try:
-            resp = device.query(cmd_str)
-            num = np.float64(resp)
-            return num
-        except visa.VisaIOError as e:
-            print('Unable to read data from device.\n', e)
-            self.__error_message()
-            return 0
-        except Exception:
-            print('Device returned an invalid responce:', resp)
+# A base class for VISA devices manipulating.
+# Every driver is an ancestor if this class.
+# To work with devices you must install a PyVISA library
+# (pip install pyvisa)
+try:
+    import visa
+except ImportError:  # newer PyVISA versions have no "visa" module
+    try:
+        import pyvisa as visa
+    except ImportError:  # no PyVISA, only a simulated backend can be used (see UseResourceManager)
+        visa = None
+import numpy as np
+import threading
+import time
+from contextlib import contextmanager
+
+# One VISA resource manager is shared by all devices of a process.
+# Open sessions are kept in a pool: if several drivers use the same address
+# (e.g. Keithley 2400 as a source and a voltmeter), they share one session,
+# it is closed when the last driver using it is closed.
+_resource_manager = None
+_sessions = {}  # address -> [resource, number of users, I/O lock]
+_pool_lock = threading.Lock()
+
+if visa is not None:
+    VisaIOError = visa.VisaIOError
+else:
+    class VisaIOError(Exception):
+        def __init__(self, error_code):
+            super().__init__(f'VISA error code {error_code}')
+            self.error_code = error_code
+
+
+def _get_resource_manager():
+    global _resource_manager
+    if _resource_manager is None:
+        if visa is None:
+            raise ImportError('PyVISA is not installed, please install it (pip install pyvisa) or use a simulation')
+        _resource_manager = visa.ResourceManager()
+    return _resource_manager
+
+
+# Replaces a VISA resource manager for all devices opened later, e.g. by a simulated backend.
+# A manager with a wants_driver_names attribute set receives names of driver classes (a device model hint)
+# in open_resource(address, driver_names=[...]).
+def UseResourceManager(resource_manager):
+    global _resource_manager
+    with _pool_lock:
+        _resource_manager = resource_manager
+
+
+# Converts GPIB number or VISA address to a VISA address
+def _make_address(device_id):
+    if isinstance(device_id, int):
+        return f"GPIB0::{int(device_id)}::INSTR"
+    elif isinstance(device_id, str):
+        return str(device_id)
+    else:
+        raise ValueError('Invalid device initialization, please provide GPIB num or device address.')
+
+
+# Returns an open session for an address and its I/O lock, opens a session if needed
+def _open_session(address, driver_names=()):
+    with _pool_lock:
+        entry = _sessions.get(address)
+        if entry is None:
+            rm = _get_resource_manager()
+            if getattr(rm, 'wants_driver_names', False):
+                resource = rm.open_resource(address, driver_names=driver_names)
+            else:
+                resource = rm.open_resource(address)
+            entry = [resource, 0, threading.RLock()]
+            _sessions[address] = entry
+        entry[1] += 1
+        return entry[0], entry[2]
+
+
+# Releases a session, closes it if nobody uses it anymore
+def _close_session(address):
+    with _pool_lock:
+        entry = _sessions.get(address)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del _sessions[address]
+            try:
+                entry[0].close()
+            except Exception:
+                pass
+
+
+# I/O statistics.
+# Every bus operation is counted per instrument (address) and per command class: an operation kind
+# ("write" or "query") and a header of the first command, e.g. "SOURCE:LEVEL".
+# Latencies are stored in a histogram with logarithmic bins, so percentiles are estimated
+# without storing every call.
+IO_LATENCY_BINS = np.logspace(-5, 2, 71)  # bin edges, seconds: 10 us ... 100 s, 10 bins per decade
+VI_ERROR_TMO = -1073807339  # VISA timeout error code
+
+
+class IOStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.total_time = 0.
+        self.max_time = 0.
+        self.histogram = np.zeros(len(IO_LATENCY_BINS) + 1, dtype=np.int64)
+
+    def Add(self, latency, bytes_out, bytes_in, error=None):
+        self.count += 1
+        self.bytes_out += bytes_out
+        self.bytes_in += bytes_in
+        self.total_time += latency
+        self.max_time = max(self.max_time, latency)
+        self.histogram[np.searchsorted(IO_LATENCY_BINS, latency)] += 1
+        if error is not None:
+            self.errors += 1
+            if getattr(error, 'error_code', None) == VI_ERROR_TMO:
+                self.timeouts += 1
+
+    # Latency percentile (q from 0 to 100), seconds. An upper edge of a histogram bin is returned.
+    def Percentile(self, q):
+        if self.count == 0:
+            return np.nan
+        k = np.searchsorted(np.cumsum(self.histogram), q / 100 * self.count)
+        if k >= len(IO_LATENCY_BINS):
+            return self.max_time
+        return min(IO_LATENCY_BINS[k], self.max_time)
+
+    def Summary(self):
+        return {'count': self.count, 'errors': self.errors, 'timeouts': self.timeouts,
+                'bytes_out': self.bytes_out, 'bytes_in': self.bytes_in,
+                'total': self.total_time, 'mean': self.total_time / self.count if self.count else np.nan,
+                'p50': self.Percentile(50), 'p95': self.Percentile(95), 'max': self.max_time}
+
+
+_io_stats = {}  # address -> {(kind, command class): IOStats}
+_io_stats_lock = threading.Lock()
+
+
+def _command_class(cmd_str):
+    cmd = cmd_str.split(';', 1)[0].strip().lstrip(':')
+    return cmd.split(None, 1)[0].upper() if cmd else ''
+
+
+def _response_size(resp):
+    if isinstance(resp, np.ndarray):
+        return resp.nbytes
+    return len(resp) if isinstance(resp, (str, bytes)) else 0
+
+
+def _record_io(address, kind, cmd_str, latency, bytes_in, error=None):
+    key = (kind, _command_class(cmd_str))
+    with _io_stats_lock:
+        instrument = _io_stats.setdefault(address, {})
+        stats = instrument.get(key)
+        if stats is None:
+            stats = instrument[key] = IOStats()
+        stats.Add(latency, len(cmd_str), bytes_in, error)
+
+
+# Returns I/O statistics: {address: {"kind COMMAND": summary dictionary}}, for one address or all instruments
+def GetIOStatistics(address=None):
+    with _io_stats_lock:
+        addresses = list(_io_stats) if address is None else [address]
+        return {a: {f'{kind} {cmd}': stats.Summary() for (kind, cmd), stats in _io_stats.get(a, {}).items()}
+                for a in addresses}
+
+
+def ResetIOStatistics():
+    with _io_stats_lock:
+        _io_stats.clear()
+
+
+# Saves I/O statistics as a text table, instruments and command classes are sorted by total I/O time.
+# Returns False if there are no statistics (e.g. no VISA devices were used).
+def DumpIOStatistics(filename):
+    all_stats = GetIOStatistics()
+    if not all_stats:
+        return False
+    columns = ['count', 'errors', 'timeouts', 'bytes_out', 'bytes_in', 'total', 'mean', 'p50', 'p95', 'max']
+    totals = {a: sum(s['total'] for s in cmds.values()) for a, cmds in all_stats.items()}
+    with open(filename, 'w') as f:
+        for address in sorted(all_stats, key=totals.get, reverse=True):
+            f.write(f'{address}: total I/O time {totals[address]:.3f} s\n')
+            f.write('command\t' + '\t'.join(columns) + '\n')
+            cmds = all_stats[address]
+            for cmd in sorted(cmds, key=lambda c: cmds[c]['total'], reverse=True):
+                s = cmds[cmd]
+                f.write(cmd + '\t' + '\t'.join(f'{s[c]:.6g}' for c in columns) + '\n')
+            f.write('\n')
+    return True
+
+
+# An exception to be thrown if an operation with a device failed after all retries (see visa_device.SetErrorPolicy)
+class VisaDeviceError(Exception):
+    def __init__(self, address, cmd_str, error):
+        super().__init__(f'{address}: "{cmd_str.strip()}" failed: {error}')
+        self.address = address
+        self.command = cmd_str
+        self.error = error
+
+
+class visa_device:
+    # Command batching parameters, may be overridden in child classes.
+    # Batched commands are joined with ";" into writes of no more than batch_max_length characters.
+    # batch_root is added to every batched command (except common "*" commands),
+    # a leading colon makes SCPI commands absolute, so they do not depend on a previous command in a batch.
+    batch_max_length = 250
+    batch_root = ':'
+
+    # Commands after which cached settings (see SendCached) are not valid anymore, may be extended in child classes
+    state_reset_commands = ('*RST', '*RCL')
+
+    # Error policy, may be overridden in child classes or changed for an instrument by SetErrorPolicy.
+    # A failed operation is retried io_retries times, a pause before a retry is retry_backoff seconds
+    # and is doubled each time; after a timeout a device is cleared (its I/O buffers are reset).
+    # If all attempts fail, VisaDeviceError is raised if raise_errors is True, otherwise a write is skipped
+    # and a query returns NaN ("" or an empty array for strings and arrays), not a valid-looking zero.
+    io_timeout = None  # seconds, None - a VISA default
+    io_retries = 2
+    retry_backoff = 0.05
+    raise_errors = False
+
+    # Data format commands for bulk transfers (see GetFloatArray), defined in child classes.
+    # binary_format must switch a device to little-endian floats in an IEEE-488.2 block,
+    # binary_datatype is their struct type: 'd' - 64-bit, 'f' - 32-bit.
+    # None means that a device supports ASCII data only.
+    binary_format = None
+    binary_datatype = 'd'
+    ascii_format = 'FORMat:DATA ASCii'
+
+    def __init__(self, device_id):
+        self._batch = None  # commands queued inside a Batch() block
+        self._shadow = {}  # setting name -> command which set it, see SendCached
+        self.address = _make_address(device_id)
+        # I/O lock is shared by all drivers using this session, one command-response exchange at a time
+        self.device, self._io_lock = _open_session(self.address, [c.__name__ for c in type(self).__mro__])
+        self.__closed = False
+        if self.io_timeout is not None:
+            self.device.timeout = self.io_timeout * 1000  # milliseconds
+
+    # Changes an error policy of this instrument, None values are not changed
+    def SetErrorPolicy(self, timeout=None, retries=None, backoff=None, raise_errors=None):
+        if timeout is not None:
+            self.io_timeout = timeout
+            self.device.timeout = timeout * 1000
+        if retries is not None:
+            self.io_retries = retries
+        if backoff is not None:
+            self.retry_backoff = backoff
+        if raise_errors is not None:
+            self.raise_errors = raise_errors
+
+    # Releases a device session (it is closed when the last driver using it is released)
+    def Close(self):
+        if getattr(self, '_visa_device__closed', True):
+            return
+        self.__closed = True
+        _close_session(self.address)
+
+    def __del__(self):
+        self.Close()
+
+    def _batched_command(self, cmd_str):
+        cmd_str = cmd_str.strip()
+        if self.batch_root and not cmd_str.startswith((':', '*')):
+            cmd_str = self.batch_root + cmd_str
+        return cmd_str
+
+    # Sends several commands in as few bus transactions as possible
+    def SendMany(self, commands):
+        chunk = ''
+        for cmd in commands:
+            cmd = self._batched_command(cmd)
+            if chunk and len(chunk) + 1 + len(cmd) > self.batch_max_length:
+                self.SendString(chunk)
+                chunk = ''
+            chunk = f'{chunk};{cmd}' if chunk else cmd
+        if chunk:
+            self.SendString(chunk)
+
+    # A context manager: all SendString calls inside a "with device.Batch():" block are queued
+    # and sent by SendMany at the block end. A query inside a block sends queued commands first.
+    @contextmanager
+    def Batch(self):
+        if self._batch is not None:  # nested block, the outer one will send everything
+            yield
+            return
+        self._batch = []
+        try:
+            yield
+        finally:
+            self._flush_batch()
+
+    def _flush_batch(self):
+        commands, self._batch = self._batch, None
+        if commands:
+            self.SendMany(commands)
+
+    # Shadow state of instrument settings.
+    # A driver sends settings which are often repeated with the same value by SendCached.
+    # If the same command was already sent for a setting, it is not sent again.
+    # All cached settings are forgotten after an I/O error or a reset command.
+    # Returns True if a command was sent.
+    def SendCached(self, key, cmd_str):
+        if self._shadow.get(key) == cmd_str:
+            return False
+        self._shadow[key] = cmd_str  # before sending, so an I/O error will invalidate it
+        self.SendString(cmd_str)
+        return True
+
+    # A command which set a cached setting, None if it is unknown
+    def CachedSetting(self, key):
+        return self._shadow.get(key)
+
+    # Forgets one cached setting, or all settings if key is None
+    def InvalidateCached(self, key=None):
+        if key is None:
+            self._shadow.clear()
+        else:
+            self._shadow.pop(key, None)
+
+    def _check_state_reset(self, cmd_str):
+        for cmd in cmd_str.split(';'):
+            if cmd.strip().lstrip(':').upper().startswith(self.state_reset_commands):
+                self.InvalidateCached()
+                return
+
+    # Waits until a reading buffer of a device holds n_points readings, no more than timeout seconds.
+    # Returns False on timeout.
+    def _wait_buffer_points(self, n_points, timeout):
+        deadline = time.time() + timeout
+        while not self.GetFloat('TRACe:POINts:ACTual?') >= n_points:  # NaN if a query failed
+            if time.time() > deadline:
+                print(f'Warning! Buffer of {self.address} was not filled in time')
+                return False
+            time.sleep(0.1)
+        return True
+
+    # Performs a bus operation (a function without arguments) and records its statistics.
+    # I/O errors are retried according to an error policy, VisaDeviceError is raised if all attempts failed.
+    def _io(self, kind, cmd_str, operation):
+        error = None
+        for attempt in range(self.io_retries + 1):
+            if attempt > 0:
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            with self._io_lock:
+                t_start = time.perf_counter()
+                try:
+                    result = operation()
+                except VisaIOError as e:
+                    _record_io(self.address, kind, cmd_str, time.perf_counter() - t_start, 0, e)
+                    error = e
+                    if e.error_code == VI_ERROR_TMO:
+                        self.__clear_device()
+                    continue
+                except Exception as e:
+                    _record_io(self.address, kind, cmd_str, time.perf_counter() - t_start, 0, e)
+                    raise
+                _record_io(self.address, kind, cmd_str, time.perf_counter() - t_start, _response_size(result))
+                return result
+        raise VisaDeviceError(self.address, cmd_str, error)
+
+    # Device clear: resets device I/O buffers, e.g. to drop a late response after a timeout
+    def __clear_device(self):
+        try:
+            self.device.clear()
+        except VisaIOError:
+            pass
+
+    # I/O statistics of this instrument, see GetIOStatistics
+    @property
+    def IOStatistics(self):
+        return GetIOStatistics(self.address)[self.address]
+
+    # Switches a data format of a device, if it supports binary transfers
+    def _use_format(self, binary):
+        if self.binary_format is not None:
+            self.SendCached('format', self.binary_format if binary else self.ascii_format)
+
+    def __error_message(self):
+        print('Check that device is connected, visible in NI MAX and is not used by another software.')
+
+    def SendString(self, cmd_str):
+        if self._batch is not None:
+            self._batch.append(cmd_str)
+            return
+        device = self.device
+        if self._shadow:
+            self._check_state_reset(cmd_str)
+        try:
+            self._io('write', cmd_str, lambda: device.write(cmd_str))
+        except VisaDeviceError as e:
+            self.InvalidateCached()  # a device state is unknown now
+            print('Unable to connect device.\n', e)
+            self.__error_message()
+            if self.raise_errors:
+                raise
+
+    def GetString(self, cmd_str):
+        self._use_format(binary=False)
+        if self._batch:
+            self._flush_batch()
+            self._batch = []
+        device = self.device
+        try:
+            return self._io('query', cmd_str, lambda: device.query(cmd_str))
+        except VisaDeviceError as e:
+            print('Unable to connect device.\n', e)
+            self.__error_message()
+            if self.raise_errors:
+                raise
+            return ""
+
+    # Queries a list of numbers and returns it as a numpy array.
+    # If a device supports it, data is transferred as a binary block (no string formatting and parsing),
+    # otherwise as comma-separated ASCII values.
+    # timeout - seconds, for long operations (e.g. a hardware sweep), a session timeout is used if None
+    def GetFloatArray(self, cmd_str, timeout=None):
+        binary = self.binary_format is not None
+        self._use_format(binary)
+        if self._batch:
+            self._flush_batch()
+            self._batch = []
+        device = self.device
+        try:
+            with self._io_lock:
+                old_timeout = device.timeout
+                if timeout is not None:
+                    device.timeout = timeout * 1000  # milliseconds
+                try:
+                    if binary:
+                        return self._io('query', cmd_str, lambda: device.query_binary_values(
+                            cmd_str, datatype=self.binary_datatype, is_big_endian=False, header_fmt='ieee', container=np.array))
+                    return self._io('query', cmd_str, lambda: device.query_ascii_values(cmd_str, container=np.array))
+                finally:
+                    device.timeout = old_timeout
+        except VisaDeviceError as e:
+            print('Unable to read data from device.\n', e)
+            self.__error_message()
+            if self.raise_errors:
+                raise
+            return np.array([])
+        except ValueError as e:
+            print('Device returned an invalid responce to', cmd_str)
+            if self.raise_errors:
+                raise VisaDeviceError(self.address, cmd_str, e)
+            return np.array([])
+
+    def GetFloat(self, cmd_str):
+        self._use_format(binary=False)
+        if self._batch:
+            self._flush_batch()
+            self._batch = []
+        device = self.device
+        resp = ""
+
+        try:
+            resp = self._io('query', cmd_str, lambda: device.query(cmd_str))
+            num = np.float64(resp)
+            return num
+        except VisaDeviceError as e:
+            print('Unable to read data from device.\n', e)
+            self.__error_message()
+            if self.raise_errors:
+                raise
+            return np.nan
+        except ValueError as e:
+            print('Device returned an invalid responce:', resp)
+            if self.raise_errors:
+                raise VisaDeviceError(self.address, cmd_str, e)
+            return np.nan
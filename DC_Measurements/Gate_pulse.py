@@ -92,6 +92,16 @@ def MeasureOneVoltage():
     voltages.append(v)
 
 
+# The last measured V(t) point, for start/end marks.
+# Points are added only by a measurement thread, so it waits for one if a new V(t) is empty
+def LastVoltagePoint():
+    while len(times) == 0 and not f_exit.is_set():
+        time.sleep(0.05)
+    if len(times) == 0:  # a program was closed
+        sys.exit(0)
+    return times[-1], voltages[-1]
+
+
 # read trigger signal and mark begin/end of each waveform
 def HandleTrigger():
     global triggerState, nStarts
@@ -112,11 +122,33 @@ def HandleTrigger():
         triggerState = False
 
 
+# Take all samples streamed since the previous call, average them by num_samples and add to V(t)
+def ReadStreamedVoltages(sense, next_index):
+    n = shell.num_samples
+    n_ready = (sense.SamplesWritten - next_index) // n * n
+    if n_ready == 0:
+        return next_index
+
+    t_samples, data = sense.GetSamples(next_index, next_index + n_ready)
+    times.extend(t_samples[::n] - start_time)
+    voltages.extend(data[:, sense.ChannelColumn(6)].reshape(-1, n).mean(axis=1) / shell.gain)
+    return next_index + n_ready
+
+
 # A thread for voltage measurement
 def VoltageMeasurementProc():
+    sense = iv_sweeper.sense
+    if not streaming:
+        while not f_exit.is_set():
+            MeasureOneVoltage()
+            # HandleTrigger()
+        return
+
+    next_index = sense.SamplesWritten
     while not f_exit.is_set():
-        MeasureOneVoltage()
-        # HandleTrigger()
+        time.sleep(0.1)
+        next_index = ReadStreamedVoltages(sense, next_index)
+    sense.StopStreaming()
 
 
 @MeasurementProc(EquipmentCleanup)
@@ -127,19 +159,20 @@ def MeasurementProc():
         times = []
         voltages = []
 
-        MeasureOneVoltage()
-        pw.MarkPointOnLine(tabMainVT, times[-1], voltages[-1], 'go', markersize=8)
+        t_start, v_start = LastVoltagePoint()
+        pw.MarkPointOnLine(tabMainVT, t_start, v_start, 'go', markersize=8)
         if len(tempsMomental) == 0:
             UpdateRealtimeThermometer()
-        pw.MarkPointOnLine(tabTemp, times[-1], tempsMomental[-1], 'go')
+        pw.MarkPointOnLine(tabTemp, t_start, tempsMomental[-1], 'go')
 
         AWG.GenerateAndSetOutput(length, length, n_repeat)
         print('Duration:', 2*length*n_repeat + length, 'sec')
 
         time.sleep(2*length*n_repeat + length)  # high and low voltage, repeat
 
-        pw.MarkPointOnLine(tabMainVT, times[-1], voltages[-1], 'ro', markersize=8)
-        pw.MarkPointOnLine(tabTemp, times[-1], tempsMomental[-1], 'ro')
+        t_end, v_end = LastVoltagePoint()
+        pw.MarkPointOnLine(tabMainVT, t_end, v_end, 'ro', markersize=8)
+        pw.MarkPointOnLine(tabTemp, t_end, tempsMomental[-1], 'ro')
 
         DataSave(length)
 
@@ -154,7 +187,7 @@ shell = ScriptShell('Gate_pulse')
 Log = Logger(shell)
 
 # Initialize devices
-iv_sweeper = EquipmentBase(shell, temp_mode='passive')
+iv_sweeper = EquipmentBase(shell, temp_mode='passive', leonardo_channels=(4, 6))  # signal and trigger
 
 # parse user-defined parameters
 try:
@@ -202,6 +235,12 @@ tempsMomental = []
 f_exit = threading.Event()
 start_time = time.time()
 
+# Leonardo acquires continuously, so V(t) has no gaps between points.
+# Streaming starts before any thread, so the board is read only by a streaming thread
+streaming = hasattr(iv_sweeper.sense, 'StartStreaming')
+if streaming:
+    iv_sweeper.sense.StartStreaming()
+
 # start measurement threads
 measurement_thread = threading.Thread(target=VoltageMeasurementProc)
 measurement_thread.start()
@@ -10,7 +10,12 @@ from Lib.lm_utils import *
 def DataSave():
     if not shell.f_save:
         return
-    shell.SaveData({f'I_{shell.I_units}A': currValues, f'U_{shell.V_units}V': voltValues, 'R_Ohm': R_values})
+    data = {f'I_{shell.I_units}A': currValues, f'U_{shell.V_units}V': voltValues, 'R_Ohm': R_values}
+    if shell.adaptive_error is not None:
+        data['N_samples'] = samplesUsed
+    # a readout device may give no error estimates (NaN), then an error column is not saved
+    errors = {f'U_{shell.V_units}V': voltErrors} if np.isfinite(voltErrors).any() else None
+    shell.SaveData(data, errors=errors)
 
     fname = shell.GetSaveFileName(ext='pdf')
     pp = PdfPages(fname[:-3] + 'pdf')
@@ -41,12 +46,11 @@ def MeasurementThreadProc():
     iv_sweeper.SetOutput(0)
     zero_value = iv_sweeper.MeasureNow(6) / shell.gain
 
-    for i, volt in enumerate(sweep_seq.sequence):
-        iv_sweeper.SetOutput(volt)
-        # time.sleep(shell.step_delay)
-
-        V_meas = iv_sweeper.MeasureNow(6) / shell.gain - zero_value
+    for i, (volt, V_meas, V_err) in enumerate(iv_sweeper.Sweep(sweep_seq.sequence, 0, channel=6)):
+        V_meas = V_meas / shell.gain - zero_value
         voltValues.append(V_meas / shell.k_V_meas)
+        voltErrors.append(V_err / shell.gain / shell.k_V_meas)
+        samplesUsed.append(iv_sweeper.SamplesUsed)
         currValues.append((volt / shell.R) / shell.k_A)
 
         if fMeasDeriv:
@@ -78,6 +82,8 @@ iv_sweeper = EquipmentBase(shell)
 sweep_seq = SweepSequence(shell.rangeA, shell.stepA)
 
 voltValues = []
+voltErrors = []
+samplesUsed = []
 currValues = []
 R_values = []
 
@@ -59,7 +59,7 @@ def DataSave():
 def UpdateRealtimeThermometer():
     global times, tempsMomental, t
     T_curr = iv_sweeper.lakeshore.GetTemperature()
-    if T_curr != 0:
+    if IsValidTemperature(T_curr):
         times.append(t)
         t += 1
         tempsMomental.append(T_curr)
@@ -56,7 +56,7 @@ def EquipmentCleanup():
 def UpdateRealtimeThermometer():
     global times, tempsMomental, t
     T_curr = iv_sweeper.lakeshore.GetTemperature()
-    if T_curr != 0:
+    if IsValidTemperature(T_curr):
         times.append(t)
         t += 1
         tempsMomental.append(T_curr)
@@ -88,7 +88,9 @@ def thread_proc():
 
     # Temperature change and measurement process!
     for i, temp in enumerate(iv_sweeper.lakeshore):
-        temp = iv_sweeper.lakeshore.GetTemperature()
+        temp_now = iv_sweeper.lakeshore.GetTemperature()
+        if IsValidTemperature(temp_now):  # otherwise keep the last temperature measured while stabilizing
+            temp = temp_now
         # read 
         # write data to logs
         Log.AddParametersEntry('T', temp, 'K', PID=iv_sweeper.lakeshore.pid,
@@ -179,7 +181,7 @@ def thread_proc():
                 pw.MarkPointOnLine(tabTemp, times[-1], tempsMomental[-1], 'ro', markersize=4)
 
                 mean_temp = np.mean(this_T)
-                if abs(mean_temp - temp) > 0.005:  # toleracy is 5 mK
+                if not abs(mean_temp - temp) <= 0.005:  # toleracy is 5 mK
                     print(f'Temperature was unstable, desired - {temp}, average - {mean_temp}. Now retrying...')
 
                     # retry loop, do not exit while
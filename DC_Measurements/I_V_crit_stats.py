@@ -39,12 +39,12 @@ def main_thread():
         pw.SetHeader(tabIV, f'Critical current variability stats, curve {N + 1} of {N_stats}')
         line = pw.addAdditionalLine(tabIV)
 
-        for nv, volt in enumerate(sweep_seq.sequence):
-            # Measure
-            iv_sweeper.SetOutput(volt)
-            time.sleep(shell.step_delay)
-
-            V_meas = iv_sweeper.MeasureNow(6) / shell.gain  # volts
+        if pulse_width is not None:
+            sweep = iv_sweeper.PulsedSweep(sweep_seq.sequence, pulse_width)
+        else:
+            sweep = iv_sweeper.Sweep(sweep_seq.sequence, shell.step_delay, channel=6)
+        for nv, (volt, V_meas, _) in enumerate(sweep):
+            V_meas /= shell.gain  # volts
 
             V = V_meas / shell.k_V_meas
             A = (volt / shell.R) / shell.k_A
@@ -108,12 +108,17 @@ iv_sweeper = EquipmentBase(shell)
 # all Yokogawa generated values (always in volts!!!)
 sweep_seq = SweepSequence(shell.rangeA, shell.stepA)
 
-# Statistics parameters
+# Statistics parameters: "N_stats;pulse_width", a pulse width (seconds) is optional
 try:
-    N_stats = int(shell.user_params)
+    params = [float(i) for i in shell.user_params.split(';')]
+    N_stats = int(params[0])
+    pulse_width = params[1] if len(params) > 1 else None
 except Exception:
     N_stats = 50  # how many I-U curves will be measured
+    pulse_width = None  # a pulsed mode (Keithley 6221 only) is not used
 print('Curves to collect: ', N_stats)
+if pulse_width is not None:
+    print('Pulsed mode, pulse width:', pulse_width, 's')
 
 # remaining / estimated time
 time_mgr = TimeEstimator(N_stats)
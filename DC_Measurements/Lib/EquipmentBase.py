@@ -1,16 +1,26 @@
 from Drivers.Yokogawa import *
 from Drivers.Leonardo import *
+from Drivers.LeonardoFilters import *
 from Drivers.Keithley2182A import *
 from Drivers.Keithley6200 import *
 from Drivers.Keithley2400 import *
 from Drivers.LakeShore370 import *
 from Drivers.LakeShore335 import *
+from Drivers.async_visa_device import RunConcurrently
 
 from Lib.lm_utils import *
 
+import threading
+
+
+# Leonardo channel where a sample voltage is measured by all scripts
+LEONARDO_SIGNAL_CHANNEL = 6
+
 
 class EquipmentBase:
-    def __init__(self, shell: ScriptShell, temp_mode=None, temp_start=None, temp_end=None, temp_step=None):
+    # leonardo_channels - Leonardo channels to be digitised, only these ones can be measured
+    def __init__(self, shell: ScriptShell, temp_mode=None, temp_start=None, temp_end=None, temp_step=None,
+                 leonardo_channels=(LEONARDO_SIGNAL_CHANNEL,)):
         max_range_value = (shell.rangeA / shell.R)
         print('m', max_range_value)
         error_message = 'This device type is not supported yet!'
@@ -35,10 +45,34 @@ class EquipmentBase:
         else:
             raise ValueError(error_message)
 
+        # Statistics of all readout channels from the last acquisition, for devices which can read
+        # all channels at once. Each channel is served from it once, a repeated request makes a new read.
+        # Stats are stored with an output token (see _output_token) and are not served after an output change.
+        self._cached_stats = None
+        self._cached_token = None
+        self._served_channels = set()
+        self._output_changes = 0  # increased by InvalidateCache
+        self._cache_lock = threading.Lock()  # measurements may be requested from several threads
+
+        # step Yokogawa sweeps from its program memory, see Sweep
+        self._use_program = shell.program_sweep
+
+        # adaptive averaging parameters, see SetAdaptiveAveraging
+        self._adaptive_sem = None
+        self._adaptive_max_samples = None
+
         print('\nReadout device is: ')
         if shell.readout_device_type == READOUT_LEONARDO:
             print('Leonardo')
-            self._sense = Leonardo(n_samples=shell.num_samples)
+            if shell.mains_window:
+                # a block must contain whole mains periods, otherwise a mains window can not be applied
+                n_samples = MainsBlockSize(shell.num_samples, LEONARDO_SAMPLE_FREQ)
+                if n_samples != shell.num_samples:
+                    print(f'Mains window: {n_samples} samples in a point instead of {shell.num_samples}')
+                    shell.num_samples = n_samples
+            self._sense = Leonardo(channels=leonardo_channels, n_samples=shell.num_samples)
+            if shell.mains_window:
+                self._sense.AddFilter(MainsCycleWindow())
         elif shell.readout_device_type == READOUT_KEITHLEY_2182A:
             print('Keithley 2182A, ID =', shell.read_device_id)
             self._sense = Keithley2182A(device_num=shell.read_device_id)
@@ -52,6 +86,16 @@ class EquipmentBase:
         else:
             raise ValueError(error_message)
 
+        if shell.simulate:  # a simulated sample is biased by a source through shell.R, Leonardo measures it with gain
+            from Drivers.InstrumentSimulator import ConfigureSimulation
+            ConfigureSimulation(bias_resistance=shell.R, gain=shell.gain, excitation=self._source)
+
+        if shell.adaptive_error is not None:
+            max_samples = shell.adaptive_max_samples if shell.adaptive_max_samples is not None \
+                else 20 * shell.num_samples
+            # a target is set for a sample voltage, Leonardo measures it multiplied by gain
+            self.SetAdaptiveAveraging(shell.adaptive_error * shell.gain, max_samples)
+
         if temp_mode is None:
             return
         print('Temperature control device is: ', end='')
@@ -62,11 +106,195 @@ class EquipmentBase:
             self._ls = LakeShore335(device_num=shell.lakeshore, mode=temp_mode, control_channel='A', heater_channel=1,
                                     temp_0=temp_start, max_temp=temp_end, temp_step=temp_step)
 
+    # Measures a channel. If a readout device supports reading all channels at once (Leonardo),
+    # several different channels requested at one sweep step are served from one acquisition.
     def MeasureNow(self, channel):
-        return self._sense.MeasureNow(channel)
+        return self.MeasureNowWithError(channel)[0]
+
+    # Measures a channel and returns a tuple (value, standard error of the value).
+    # If a readout device cannot estimate an error, it is NaN.
+    def MeasureNowWithError(self, channel):
+        if self._sense is not self._source and hasattr(self._source, 'Synchronize'):
+            self._source.Synchronize()  # a level must be set before another device measures
+        if not hasattr(self._sense, 'MeasureStats'):
+            return self._sense.MeasureNow(channel), np.nan
+        if hasattr(self._sense, 'ChannelColumn'):
+            self._sense.ChannelColumn(channel)  # raises an error if a channel is not digitised
+
+        with self._cache_lock:
+            token = self._output_token()
+            if self._cached_stats is None or channel in self._served_channels or self._cached_token != token:
+                if self._adaptive_sem is not None:
+                    self._cached_stats = self._sense.MeasureStatsAdaptive(channel, self._adaptive_sem,
+                                                                          self._adaptive_max_samples)
+                else:
+                    self._cached_stats = self._sense.MeasureStats()
+                self._cached_token = token
+                self._served_channels = set()
+            self._served_channels.add(channel)
+            return self._cached_stats.mean[channel], self._cached_stats.sem[channel]
+
+    # Identifies a source output state: it changes with SetOutput and InvalidateCache,
+    # and with a level set by direct driver calls (a level command cached by a driver, see SendCached)
+    def _output_token(self):
+        level = self._source.CachedSetting('level') if hasattr(self._source, 'CachedSetting') else None
+        return self._output_changes, level
+
+    # Measures a channel and performs other reads (functions without arguments, e.g. lakeshore.GetTemperature
+    # or gate GetOutput) concurrently, so their I/O times overlap.
+    # Returns a list: [measured value, results of other reads...]
+    def MeasureConcurrently(self, channel, *other_reads):
+        if not other_reads:
+            return [self.MeasureNow(channel)]
+        return RunConcurrently(lambda: self.MeasureNow(channel), *other_reads)
+
+    # Sweeps a source through values (in volts), waiting delay seconds at each point, and measures a channel.
+    # Yields tuples (value, measured value, standard error or NaN) for each point.
+    # If devices support a hardware sweep, it is used: points are yielded in bursts, when a device returns them.
+    # A Yokogawa program sweep is used only if it is requested ("-program" command line argument).
+    def Sweep(self, values, delay, channel=LEONARDO_SIGNAL_CHANNEL):
+        values = np.asarray(values)
+        if self._source is self._sense and hasattr(self._source, 'SweepListChunks'):  # Keithley 2400 MODE_BOTH
+            start = 0
+            for readings in self._source.SweepListChunks(values, delay):
+                for value, reading in zip(values[start: start + len(readings)], readings):
+                    yield value, reading, np.nan
+                start += len(readings)
+            self.InvalidateCache()
+            return
+        if hasattr(self._source, 'ArmListSweep') and hasattr(self._sense, 'ArmBuffer'):  # Keithley 6221 + 2182A
+            yield from self._trigger_link_sweep(values, delay, channel)
+            return
+        if self._use_program and self._can_program_sweep(delay):  # Yokogawa
+            yield from self._program_sweep(values, delay, channel)
+            return
+
+        for value in values:
+            self.SetOutput(value)
+            if delay > 0:
+                time.sleep(delay)
+            yield (value, ) + tuple(self.MeasureNowWithError(channel))
+
+    # A current source steps through a list over Trigger Link, a voltmeter stores one reading per step,
+    # readings are read back when the sweep (or its part, which fits into a voltmeter buffer) is finished
+    def _trigger_link_sweep(self, values, delay, channel):
+        n = self._sense.buffer_max_points
+        for start in range(0, len(values), n):
+            chunk = values[start: start + n]
+            self._sense.ArmBuffer(len(chunk), channel)
+            self._source.ArmListSweep(chunk, delay)
+            self._source.StartArmedSweep()
+            timeout = len(chunk) * (delay + self._sense.ReadingTime) + 5
+            readings = self._sense.ReadBuffer(len(chunk), timeout)
+            self._source.AbortSweep()
+            self._sense.DisarmBuffer()
+            self._source.SetOutput(chunk[-1])  # a sweep does not change a fixed level, keep the last value
+            for value, reading in zip(chunk, readings):
+                yield value, reading, np.nan
+        self.InvalidateCache()
+
+    # Built-in delta modes of Keithley 6221 with Keithley 2182A connected to it,
+    # see Keithley6200.MeasureDelta and Keithley6200.MeasureDifferentialConductance
+    def MeasureDelta(self, current, n_points, delay=2E-3):
+        return self._delta_mode(lambda: self._source.MeasureDelta(current, n_points, delay))
+
+    def MeasureDifferentialConductance(self, start, stop, step, delta, delay=2E-3):
+        return self._delta_mode(lambda: self._source.MeasureDifferentialConductance(start, stop, step,
+                                                                                    delta, delay))
+
+    # Pulsed I-V by Keithley 6221 pulse delta mode, see Keithley6200.MeasurePulsedSweep.
+    # Yields tuples (value, measured voltage, NaN) like Sweep.
+    def PulsedSweep(self, values, width, interval=5):
+        readings = self._delta_mode(lambda: self._source.MeasurePulsedSweep(values, width, interval))
+        for value, reading in zip(values, readings):
+            yield value, reading, np.nan
+
+    def _delta_mode(self, measure):
+        if not hasattr(self._source, 'MeasureDelta'):
+            raise ValueError('Delta modes require Keithley 6221 as an excitation device')
+        result = measure()
+        if hasattr(self._sense, 'Restore'):  # 2182A was controlled by 6221, its settings were changed
+            self._sense.Restore()
+        self.InvalidateCache()
+        return result
+
+    # Leonardo points of a program sweep are plain averages of streamed samples,
+    # so it is not used with Leonardo filters (-mains) or adaptive averaging (-AE), which would be skipped
+    def _can_program_sweep(self, delay):
+        if not hasattr(self._source, 'LoadProgram') or delay < self._source.program_min_interval:
+            return False
+        if hasattr(self._sense, 'ArmBuffer'):
+            return True
+        if not hasattr(self._sense, 'MeasureWindow'):
+            return False
+        if self._sense.Filters or self._adaptive_sem is not None:
+            print('Warning! Program sweep does not support Leonardo filters and adaptive averaging, '
+                  'a sweep is performed point by point.')
+            return False
+        return True
+
+    # A source steps through a stored program on its own timer, a step is delay + an acquisition time long.
+    # Leonardo data of each step is taken from a streaming buffer by timestamps,
+    # 2182A takes a reading delay seconds after each source step trigger (its BNC output).
+    def _program_sweep(self, values, delay, channel):
+        source, sense = self._source, self._sense
+        buffered = hasattr(sense, 'ArmBuffer')
+        if buffered:
+            n = min(source.program_max_steps, sense.buffer_max_points)
+            interval = delay + sense.ReadingTime
+        else:
+            n = source.program_max_steps
+            interval = delay + sense.BlockDuration
+            was_streaming = sense.IsStreaming
+            # a ring buffer holds a whole program, so slow processing of points does not lose data
+            sense.StartStreaming(buffer_seconds=max(10, min(n, len(values)) * interval + 5))
+        try:
+            for start in range(0, len(values), n):
+                chunk = values[start: start + n]
+                source.LoadProgram(chunk, interval)
+                if buffered:
+                    sense.ArmBuffer(len(chunk), channel, delay=delay)
+                    source.RunProgram()
+                    readings = sense.ReadBuffer(len(chunk), len(chunk) * interval + 5)
+                    sense.DisarmBuffer()
+                    for value, reading in zip(chunk, readings):
+                        yield value, reading, np.nan
+                else:
+                    t0 = source.RunProgram()
+                    for i, value in enumerate(chunk):
+                        t_step = t0 + i * interval
+                        yield (value, ) + sense.MeasureWindow(channel, t_step + delay, t_step + interval)
+        finally:
+            if not buffered and not was_streaming:
+                sense.StopStreaming()
+        self.InvalidateCache()
+
+    # Adaptive averaging: each point is averaged until its standard error becomes less than target_error
+    # (volts at a readout device input), but no more than max_samples samples are used.
+    # Pass None to return to a fixed number of samples.
+    def SetAdaptiveAveraging(self, target_error, max_samples=None):
+        if target_error is not None and not hasattr(self._sense, 'MeasureStatsAdaptive'):
+            print('Warning! Adaptive averaging is not supported by the readout device, it will not be used.')
+            return
+        self._adaptive_sem = target_error
+        self._adaptive_max_samples = max_samples
+        if target_error is not None:
+            print(f'Adaptive averaging: target error {target_error} V, no more than {max_samples} samples')
+
+    # Number of samples averaged in the last measured point, None if unknown
+    @property
+    def SamplesUsed(self):
+        return None if self._cached_stats is None else self._cached_stats.n
+
+    # Forget the last acquisition, so the next MeasureNow will read new data
+    def InvalidateCache(self):
+        with self._cache_lock:
+            self._cached_stats = None
+            self._output_changes += 1
 
     def SetOutput(self, value: float):
         self._source.SetOutput(value)
+        self.InvalidateCache()  # a new sweep step begins
 
     def GetOutput(self):
         return self._source.GetOutput()
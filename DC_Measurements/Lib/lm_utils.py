@@ -18,7 +18,11 @@ from datetime import datetime
 from copy import copy
 import numpy as np
 import pandas as pd
-import win32api
+try:
+    import win32api
+except ImportError:  # not Windows, error messages are printed
+    win32api = None
+from Drivers.visa_device import DumpIOStatistics
 
 MB_ICONSTOP = 0x10
 
@@ -93,6 +97,15 @@ class ScriptShell:
         self.f_save = True
         self.user_params = ""
 
+        self.adaptive_error = None
+        self.adaptive_max_samples = None
+        self.mains_window = False
+        self.program_sweep = False
+        self.simulate = False
+        self.record_file = None
+        self.replay_file = None
+        self.replay_realtime = True
+
     def __init__(self, title):
         self._save_path = None
         self.sample_name = ""
@@ -142,6 +155,25 @@ class ScriptShell:
 
                 p.add_argument('-nosave', action='store_true')
 
+                # adaptive averaging: target error of each point (V) and maximal number of samples in a point
+                p.add_argument('-AE', action='store', required=False, default=None)
+                p.add_argument('-AM', action='store', required=False, default=None)
+
+                # average Leonardo data over an integer number of mains periods
+                p.add_argument('-mains', action='store_true')
+
+                # step a Yokogawa sweep from its program memory (see EquipmentBase.Sweep)
+                p.add_argument('-program', action='store_true')
+
+                # use simulated instruments (see Drivers/InstrumentSimulator.py) instead of real ones
+                p.add_argument('-sim', action='store_true')
+
+                # record all instrument sessions into a file, or replay a recorded file instead of instruments
+                # (see Drivers/SessionRecorder.py), -replay_fast - without waiting for recorded device delays
+                p.add_argument('-record', action='store', required=False, default=None)
+                p.add_argument('-replay', action='store', required=False, default=None)
+                p.add_argument('-replay_fast', action='store_true')
+
                 p.add_argument('Resistance', action='store')
                 p.add_argument('Range', action='store')
                 p.add_argument('Step', action='store')
@@ -195,6 +227,15 @@ class ScriptShell:
 
                 self.user_params = args['P'][1: -1]  # remove quotes
 
+                self.adaptive_error = float(args['AE']) if args['AE'] is not None else None
+                self.adaptive_max_samples = int(args['AM']) if args['AM'] is not None else None
+                self.mains_window = args['mains']
+                self.program_sweep = args['program']
+                self.simulate = args['sim']
+                self.record_file = args['record']
+                self.replay_file = args['replay']
+                self.replay_realtime = not args['replay_fast']
+
             except Exception as e:
                 print('Error during command line parsing:')
                 print(e)
@@ -204,6 +245,15 @@ class ScriptShell:
         self.V_units = core_units[self.k_V_meas]
         self.sample_name = self._preprocess_string_for_filename(self.sample_name)
         self.structure_name = self._preprocess_string_for_filename(self.structure_name)
+        if self.replay_file is not None:
+            from Drivers.SessionRecorder import StartReplay
+            StartReplay(self.replay_file, self.replay_realtime)
+        elif self.simulate:
+            from Drivers.InstrumentSimulator import EnableSimulation
+            EnableSimulation()
+        if self.record_file is not None:
+            from Drivers.SessionRecorder import StartRecording
+            StartRecording(self.record_file)
         # print('R=', self.R, 'R*', self.k_R, 'V*', self.k_V_meas, 'A*', self.k_A)  # for debugging
 
     def _get_measurement_id(self, caption, for_folder):
@@ -267,11 +317,21 @@ class ScriptShell:
     # caption - additional string to be added to the end of file
     # data_dict - a dictionary which has a format:
     # {columnName1:[data1, data1,...], columnName2:[data2, data2,...]}
-    def SaveData(self, data_dict, caption=None, preserve_unique=True):
+    # errors - optional errors of some columns, in the same format,
+    # they are saved as columnName_err right after columnName
+    def SaveData(self, data_dict, caption=None, preserve_unique=True, errors=None):
         if caption is None:
             caption = self.title
         fname = self.GetSaveFileName(caption=caption, preserve_unique=preserve_unique)
 
+        if errors:
+            data_with_errors = {}
+            for col, values in data_dict.items():
+                data_with_errors[col] = values
+                if col in errors:
+                    data_with_errors[f'{col}_err'] = errors[col]
+            data_dict = data_with_errors
+
         df = pd.DataFrame(data_dict)
         df.to_csv(fname, sep=" ", header=True, index=False, float_format='%.8f')
 
@@ -364,6 +424,11 @@ def format_temperature(temp):
     return f'{temp} K' if temp >= 1 else f'{temp * 1e+3} mK'
 
 
+# False for a failed temperature measurement (NaN) or a zero value
+def IsValidTemperature(temp):
+    return bool(np.isfinite(temp)) and temp > 0
+
+
 class SweepSequence:
     def __init__(self, end, step):
         self.upper_line_1 = np.arange(0, end, step)
@@ -525,7 +590,10 @@ class plotWindow:
     # button press handlers
     @staticmethod
     def __ErrorMessage():
-        win32api.MessageBox(0, "Please open a tab with color mesh!", "Error", MB_ICONSTOP)
+        if win32api is not None:
+            win32api.MessageBox(0, "Please open a tab with color mesh!", "Error", MB_ICONSTOP)
+        else:
+            print('Error! Please open a tab with color mesh!')
 
     def __handler_dec(self):
         ct = self.__currtab
@@ -906,6 +974,7 @@ class Logger:
     def __init__(self, shell):
         caption = shell.title
         self.__filename = shell.GetSaveFileName(caption + '_params', ext='log')
+        self.__io_filename = shell.GetSaveFileName(caption + '_io_stats', ext='log')
         self.__lines = []
 
         self.AddGenericEntry(
@@ -913,6 +982,9 @@ class Logger:
             f'CurrentRange={(shell.rangeA / shell.R) / shell.k_A} {core_units[shell.k_A]}A;'
             f'CurrentStep={(shell.stepA / shell.R) / shell.k_A} {core_units[shell.k_A]}A; '
             f'Gain={shell.gain}; IVPointDelay={shell.step_delay} sec; LeonardoPoints={shell.num_samples}')
+        if shell.adaptive_error is not None:
+            self.AddGenericEntry(f'AdaptiveTargetError={shell.adaptive_error} V; '
+                                 f'AdaptiveMaxPoints={shell.adaptive_max_samples}')
 
     def AddGenericEntry(self, text):
         self.__lines.append(text + '\n')
@@ -927,4 +999,6 @@ class Logger:
         with open(self.__filename, 'w') as f:
             for line in self.__lines:
                 f.write(line)
-        print('Log was saved to:', self.__filename)
\ No newline at end of file
+        print('Log was saved to:', self.__filename)
+        if DumpIOStatistics(self.__io_filename):
+            print('Instruments I/O statistics was saved to:', self.__io_filename)
\ No newline at end of file
@@ -36,7 +36,7 @@ def DataSave():
 def UpdateRealtimeThermometer():
     global t, tempsMomental, times
     T_curr = iv_sweeper.lakeshore.GetTemperature()
-    if T_curr != 0:
+    if IsValidTemperature(T_curr):
         times.append(t)
         t += 1
         tempsMomental.append(T_curr)
@@ -64,8 +64,13 @@ def MeasureProc():
         return (2 * len_line - percent_points * len_line < num < 2 * len_line + percent_points * len_line) \
                or (num > 0 * len_line + percent_points * len_line) or (num < N_points - percent_points * len_line)
 
+    # a limit is checked with the last valid temperature, a measurement stops if a thermometer is not read
+    # MAX_INVALID_TEMPERATURES times in a row
     curr_temp = iv_sweeper.lakeshore.GetTemperature()
-    while (not f_exit.is_set()) and (curr_temp >= temp_limit or temp_limit == -1):
+    last_temp = curr_temp
+    n_invalid = 0 if IsValidTemperature(curr_temp) else 1
+    while (not f_exit.is_set()) and (temp_limit == -1 or not IsValidTemperature(last_temp)
+                                     or last_temp >= temp_limit):
         # measure I_V
         V_for_R = []
         I_for_R = []
@@ -77,7 +82,14 @@ def MeasureProc():
             # measure I-V point
             iv_sweeper.SetOutput(volt)
             time.sleep(shell.step_delay)
-            V_meas = iv_sweeper.MeasureNow(6) / shell.gain
+            if i == 0:  # a temperature of a curve is read from a thermometer together with its first point
+                V_meas, T_read = iv_sweeper.MeasureConcurrently(
+                    6, lambda: iv_sweeper.lakeshore.GetTemperature(max_age=0))
+                if IsValidTemperature(T_read):
+                    curr_temp = T_read
+            else:
+                V_meas = iv_sweeper.MeasureNow(6)
+            V_meas /= shell.gain
             I_values.append((volt / shell.R) / shell.k_A)
             V_values.append(V_meas / shell.k_V_meas)
 
@@ -94,7 +106,7 @@ def MeasureProc():
                 pass
 
         # Store data
-        if curr_temp != 0:
+        if IsValidTemperature(curr_temp):
             T_values.append(curr_temp)
             R_values.append(R_meas)  # Last value - there will be all points
             print('Temperature:', curr_temp, 'resistance:', R_meas)
@@ -115,6 +127,15 @@ def MeasureProc():
         time.sleep(time_to_wait)
 
         curr_temp = iv_sweeper.lakeshore.GetTemperature()  # for next measurement
+        if IsValidTemperature(curr_temp):
+            last_temp = curr_temp
+            n_invalid = 0
+        else:
+            n_invalid += 1
+            if n_invalid >= MAX_INVALID_TEMPERATURES:
+                print(f'Temperature was not read {n_invalid} times in a row, check a thermometer. '
+                      'Measurement is stopped.')
+                break
     # end while
     f_exit.set()
     exit(0)
@@ -137,6 +158,7 @@ iv_sweeper = EquipmentBase(shell, temp_mode='passive')
 sweep_seq = SweepSequence(shell.rangeA, shell.stepA)
 N_points = len(sweep_seq.sequence)
 percent_points = 0.05  # 5% points around zero to measure R
+MAX_INVALID_TEMPERATURES = 10  # consecutive failed temperature reads which stop a measurement
 
 # temperature limit from command-line parameters (in mK)
 # specify 0 in a command line to perform a measurement without a limit
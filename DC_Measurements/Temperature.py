@@ -11,7 +11,11 @@ from Lib.lm_utils import *
 parser = argparse.ArgumentParser()
 parser.add_argument('-LT', action='store', required=False, default=LAKESHORE_MODEL_370)
 parser.add_argument('-L', action='store', required=True)
+parser.add_argument('-sim', action='store_true', help='simulated devices, without real hardware')
 args, unknown = parser.parse_known_args()
+if args.sim:
+    from Drivers.InstrumentSimulator import EnableSimulation
+    EnableSimulation()
 device_id = int(args.L)
 lakeshore_model = int(args.LT)
 
@@ -7,18 +7,41 @@
 #define DEVICE_ID 1
 #define SAMPLE_FREQ 102400.
 #define CHANNEL_NUMBER 8
-#define IBSIZE 5120
+#define IBSIZE 5120 //default DMA block size (samples per channel), used if 0 is passed to InitBoard
+#define WRAPPER_ERROR_PARTIAL_BLOCK 0xFFFF0001 //driver returned less samples than requested
+#define WRAPPER_ERROR_NO_CHANNELS 0xFFFF0002 //an empty channel mask was passed to InitBoardEx
+
+//number of channels digitised in the current configuration, set by InitBoardEx
+static unsigned int g_channelCount = CHANNEL_NUMBER;
 
 
 //
-//FUNCTION: InitBoard
+//FUNCTION: InitBoardEx
 //Performs Leonardo board initialization and returns a handle to device into an argument
+//ibSize is a DMA block size (samples per channel). Make it equal to a number of samples read by PerformRead,
+//so one buffer-ready event delivers exactly one data block.
+//frequency is a sample rate of each channel, Hz.
+//channelMask: bit i set means that channel i is digitised. Data of used channels only are returned by PerformRead,
+//in ascending channel order.
 //Return value: 0 if succeeded, error code otherwise.
 //
-LEONARDO_WRAPPER_API unsigned int __stdcall InitBoard(unsigned int * pOutHandle, unsigned int ibSize)
+LEONARDO_WRAPPER_API unsigned int __stdcall InitBoardEx(unsigned int * pOutHandle, unsigned int ibSize,
+														double frequency, unsigned int channelMask)
 {
 	unsigned int st, deviceHandle;
 	URshInitDMA  p = {0};
+	unsigned int nUsed = 0;
+	for(int i=0;i<CHANNEL_NUMBER;++i)
+	{
+		if (channelMask & (1u << i))
+			++nUsed;
+	}
+	if (nUsed == 0)
+	{
+		*pOutHandle = -6;
+		return WRAPPER_ERROR_NO_CHANNELS;
+	}
+
 	st = UniDriverGetDeviceHandle(BOARD_NAME, &deviceHandle);
 	if (st != RSH_API_SUCCESS)
         {
@@ -43,11 +66,11 @@ LEONARDO_WRAPPER_API unsigned int __stdcall InitBoard(unsigned int * pOutHandle,
     p.type = rshInitDMA;
 	p.startType = URshStartTypeProgram;
 	p.dmaMode = URshInitDmaDmaModePersistent;
-	p.bufferSize = ibSize;
-	p.frequency = SAMPLE_FREQ;
+	p.bufferSize = (ibSize != 0) ? ibSize : IBSIZE;
+	p.frequency = frequency;
 	for(int i=0;i<CHANNEL_NUMBER;++i)
 	{
-		p.channels[i].control = URshChanControlUsed;
+		p.channels[i].control = (channelMask & (1u << i)) ? URshChanControlUsed : URshChanControlNotUsed;
 		p.channels[i].gain = 1;
 	}
 
@@ -64,13 +87,23 @@ LEONARDO_WRAPPER_API unsigned int __stdcall InitBoard(unsigned int * pOutHandle,
 		*pOutHandle = -5;
 		return st;
     }
+	g_channelCount = nUsed;
 	*pOutHandle = deviceHandle;
 	return RSH_API_SUCCESS;
 }
 
+//
+//FUNCTION: InitBoard
+//Initializes a board with all channels used and a default sample rate, see InitBoardEx
+//
+LEONARDO_WRAPPER_API unsigned int __stdcall InitBoard(unsigned int * pOutHandle, unsigned int ibSize)
+{
+	return InitBoardEx(pOutHandle, ibSize, SAMPLE_FREQ, (1u << CHANNEL_NUMBER) - 1);
+}
+
 //FUNCTION: PerformRead
 //Reads one data block and returns it into double array
-//A double array must be preallocated to (8*ibSize) bytes.
+//A double array must be preallocated to (number of used channels * ibSize) doubles.
 //Return value: 0 if succeeded, error code otherwise.
 //
 LEONARDO_WRAPPER_API unsigned int __stdcall PerformRead(unsigned int deviceHandle, double *pBuffer, unsigned int ibSize)
@@ -85,7 +118,11 @@ LEONARDO_WRAPPER_API unsigned int __stdcall PerformRead(unsigned int deviceHandl
 	}
 
 	unsigned int received = 0;
-	st = UniDriverLVGetDataDouble (deviceHandle,RSH_DATA_MODE_NO_FLAGS,CHANNEL_NUMBER*ibSize,&received,pBuffer);
+	st = UniDriverLVGetDataDouble (deviceHandle,RSH_DATA_MODE_NO_FLAGS,g_channelCount*ibSize,&received,pBuffer);
+	if (st == RSH_API_SUCCESS && received != g_channelCount*ibSize)
+	{
+		return WRAPPER_ERROR_PARTIAL_BLOCK;
+	}
 	return st;
 }
 
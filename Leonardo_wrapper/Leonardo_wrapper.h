@@ -5,6 +5,8 @@
 #endif
 
 LEONARDO_WRAPPER_API unsigned int __stdcall InitBoard(unsigned int * pOutHandle, unsigned int ibSize);
+LEONARDO_WRAPPER_API unsigned int __stdcall InitBoardEx(unsigned int * pOutHandle, unsigned int ibSize,
+														double frequency, unsigned int channelMask);
 LEONARDO_WRAPPER_API unsigned int __stdcall PerformRead(unsigned int deviceHandle, double *pBuffer, unsigned int ibSize);
 LEONARDO_WRAPPER_API void __stdcall FreeBoard(unsigned int deviceHandle);
 